@@ -27,10 +27,56 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
 
+    from .passwords import PasswordService
+    app.extensions['passwords'] = PasswordService(
+        method=app.config['FLASKY_PASSWORD_METHOD'],
+        workers=app.config['FLASKY_PASSWORD_WORKERS'])
+
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
+    if app.config['FLASKY_BOOTSTRAP_ROLES']:
+        from .models import Role
+        app.before_first_request(Role.ensure_roles)
+
+    if app.config['FLASKY_STATUS_SCHEDULER']:
+        from .scheduler import StatusScheduler
+        scheduler = app.extensions['status_scheduler'] = StatusScheduler(app)
+        # started with the first request so manage.py commands stay single-threaded
+        app.before_first_request(scheduler.start)
+
+    if app.config['FLASKY_LAST_SEEN_BUFFER']:
+        from .last_seen import LastSeenBuffer
+        last_seen_buffer = app.extensions['last_seen_buffer'] = LastSeenBuffer(app)
+        app.before_first_request(last_seen_buffer.start)
+
+    from .tokens import TokenService
+    app.extensions['tokens'] = TokenService(app.config['SECRET_KEY'])
+
+    from .email import EmailRenderer
+    app.extensions['email_renderer'] = EmailRenderer(app)
+
+    if app.config['FLASKY_MAIL_OUTBOX']:
+        from .email import MailOutbox
+        outbox = app.extensions['mail_outbox'] = MailOutbox(app)
+        app.before_first_request(outbox.start)
+
+    if app.config['FLASKY_TIMELINE_FANOUT']:
+        from .timeline import Timeline, LocalTimelineStore
+        app.extensions['timeline'] = Timeline(LocalTimelineStore(
+            max_users=app.config['FLASKY_TIMELINE_USERS'],
+            length=app.config['FLASKY_TIMELINE_LENGTH'],
+            ttl=app.config['FLASKY_TIMELINE_TTL']))
+
+    if app.config['FLASKY_PERF_PROFILER']:
+        from .perf import RequestProfiler
+        app.extensions['perf'] = RequestProfiler(app)
+
+    if app.config['FLASKY_PAGE_CACHE_SIZE']:
+        from .http_cache import PageCache
+        app.extensions['page_cache'] = PageCache(app.config['FLASKY_PAGE_CACHE_SIZE'])
+
     return app
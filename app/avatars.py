@@ -0,0 +1,140 @@
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+GRAVATAR_URL = 'https://secure.gravatar.com/avatar/{hash}?s={size}&d=404&r=g'
+
+
+def identicon(hash, size):
+    """A PNG of the 5x5 mirrored pattern GitHub-style identicons use,
+    derived from the hex digest `hash`."""
+    digest = bytes.fromhex(hash)
+    color = bytes(digest[-3:])
+    background = b'\xf0\xf0\xf0'
+    cells = []
+    for row in range(5):
+        left = [(digest[row * 3 + column] & 1) == 1 for column in range(3)]
+        cells.append(left + left[1::-1])
+    bands = [b'\x00' + b''.join(color if row[x * 5 // size] else background for x in range(size))
+             for row in cells]
+    return _png(size, size, b''.join(bands[y * 5 // size] for y in range(size)))
+
+
+def _png(width, height, raw):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    return b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(raw, 9)) + \
+        chunk(b'IEND', b'')
+
+
+def mimetype_of(data):
+    return 'image/jpeg' if data[:2] == b'\xff\xd8' else 'image/png'
+
+
+class AvatarCache(object):
+    """Avatars on disk, one file per (hash, size), evicting the least
+    recently served files once the directory grows past `max_bytes`.
+
+    Misses are fetched from Gravatar when `fetch` is set; addresses without
+    a Gravatar get a locally drawn identicon, which is cached as well."""
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024, fetch=True, timeout=2):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'wesalon-avatars')
+        self.max_bytes = max_bytes
+        self.fetch = fetch
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._size = None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, hash, size):
+        return os.path.join(self.directory, '%s_%d' % (hash, size))
+
+    def get(self, hash, size):
+        """Return (data, cached). `cached` is False only for a fallback
+        served because Gravatar could not be reached."""
+        path = self._path(hash, size)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+            return data, True
+        except (IOError, OSError):
+            pass
+        try:
+            data = self._download(hash, size) if self.fetch else None
+        except (IOError, OSError):
+            return identicon(hash, size), False
+        if data is None:
+            data = identicon(hash, size)
+        self._store(path, data)
+        return data, True
+
+    def _download(self, hash, size):
+        try:
+            return urlopen(GRAVATAR_URL.format(hash=hash, size=size), timeout=self.timeout).read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _store(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(os.path.join(self.directory, name))
+                                 for name in os.listdir(self.directory))
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        # shrink to 90% so evictions do not run on every store
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+_cache_lock = threading.Lock()
+
+
+def get_avatar_cache(app):
+    """The app's AvatarCache, created on first use."""
+    cache = app.extensions.get('avatar_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = app.extensions.get('avatar_cache')
+            if cache is None:
+                cache = app.extensions['avatar_cache'] = AvatarCache(
+                    directory=app.config['FLASKY_AVATAR_CACHE_DIR'],
+                    max_bytes=app.config['FLASKY_AVATAR_CACHE_BYTES'],
+                    fetch=app.config['FLASKY_AVATAR_FETCH'])
+    return cache
@@ -0,0 +1,389 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from . import create_app, db
+
+
+@contextmanager
+def make_bench_app(config_name='testing', database_url=None):
+    """Context manager for an app bound to a scratch database so benchmarks
+    never touch the development data. Defaults to a fresh SQLite file in
+    the temp dir, which is deleted on exit."""
+    path = None
+    if database_url is None:
+        fd, path = tempfile.mkstemp(prefix='wesalon-bench-', suffix='.sqlite')
+        os.close(fd)
+        database_url = 'sqlite:///' + path
+    app = create_app(config_name)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+    try:
+        yield app
+    finally:
+        if path is not None:
+            with app.app_context():
+                db.get_engine(app).dispose()
+            os.remove(path)
+
+
+def bench_enroll(app, concurrency=200, capacity=None, activities=1):
+    """Fire `concurrency` enrollers at the same instant, each signing up
+    for every one of `activities` overlapping activities, and report
+    throughput plus the outcome of every attempt."""
+    from .models import User, Role, Activity, Enrollment, EnrollmentResult
+
+    if capacity is None:
+        capacity = concurrency // 2
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        publisher = User(email='publisher@bench.local', username='publisher', password='bench')
+        users = [User(email='user%d@bench.local' % i, username='user%d' % i, password='bench')
+                 for i in range(concurrency)]
+        db.session.add(publisher)
+        db.session.add_all(users)
+        db.session.flush()
+        # all at the same time, so a participant may hold only one of them
+        begin = datetime.now() + timedelta(days=1)
+        targets = [Activity(publisher=publisher,
+                            begin_timestamp=begin,
+                            end_timestamp=begin + timedelta(hours=2),
+                            location='bench hall %d' % i,
+                            name='bench',
+                            capacity=capacity) for i in range(activities)]
+        db.session.add_all(targets)
+        db.session.commit()
+        activity_ids = [activity.id for activity in targets]
+        user_ids = [u.id for u in users]
+        db.session.remove()
+
+    attempts = [(activity_id, user_id) for user_id in user_ids for activity_id in activity_ids]
+    barrier = threading.Barrier(len(attempts))
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def enroller(activity_id, user_id):
+        with app.app_context():
+            activity = Activity.query.get(activity_id)
+            participant = User.query.get(user_id)
+            barrier.wait()
+            try:
+                result = Enrollment.enroll(activity, participant)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                result = type(e).__name__
+            finally:
+                db.session.remove()
+            with lock:
+                outcomes[result] += 1
+
+    threads = [threading.Thread(target=enroller, args=attempt) for attempt in attempts]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    with app.app_context():
+        per_activity = [Enrollment.query.filter_by(activity_id=activity_id).count()
+                        for activity_id in activity_ids]
+        double_booked = db.session.query(Enrollment.participant_id). \
+            group_by(Enrollment.participant_id).having(db.func.count(Enrollment.id) > 1).count()
+        db.session.remove()
+    names = dict((v, k.lower()) for k, v in vars(EnrollmentResult).items() if not k.startswith('_'))
+    return {'concurrency': concurrency,
+            'activities': activities,
+            'capacity': capacity,
+            'enrolled': sum(per_activity),
+            'oversubscribed': max(per_activity) > capacity,
+            'double_booked': double_booked,
+            'elapsed': elapsed,
+            'throughput': len(attempts) / elapsed,
+            'outcomes': dict((names.get(k, k), v) for k, v in outcomes.items())}
+
+
+def bench_logins(app, logins=200, threads=8, method=None, workers=0):
+    """Post `logins` logins to /auth/login from `threads` client threads of
+    this one process and report logins per second for it, i.e. for a single
+    web worker, with the given hash `method` and password pool `workers`."""
+    from .models import User, Role
+    from .passwords import PasswordService
+
+    passwords = app.extensions['passwords'] = PasswordService(
+        method=method or app.config['FLASKY_PASSWORD_METHOD'], workers=workers)
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email='login@bench.local', username='login', password='bench',
+                            confirmed=True))
+        db.session.commit()
+        db.session.remove()
+
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def client(count):
+        c = app.test_client()
+        for i in range(count):
+            response = c.post('/auth/login', data={'email': 'login@bench.local',
+                                                   'password': 'bench'})
+            c.get('/auth/logout')
+            with lock:
+                outcomes['ok' if response.status_code == 302 else response.status_code] += 1
+
+    shares = [logins // threads + (1 if i < logins % threads else 0) for i in range(threads)]
+    clients = [threading.Thread(target=client, args=[share]) for share in shares if share]
+    start = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.time() - start
+    passwords.shutdown()
+    return {'logins': logins,
+            'threads': threads,
+            'method': passwords.method,
+            'workers': workers,
+            'elapsed': elapsed,
+            'throughput': logins / elapsed,
+            'outcomes': dict(outcomes)}
+
+
+def bench_mail(app, messages=500, workers=None, batch_size=None):
+    """Deliver `messages` queued emails to a local aiosmtpd server through
+    the outbox workers and report messages per second."""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise RuntimeError('the mail benchmark needs aiosmtpd (pip install aiosmtpd)')
+    from . import mail
+    from .email import MailOutbox
+    from .models import OutboxMessage
+
+    received = Counter()
+
+    class CountingHandler(object):
+        async def handle_DATA(self, server, session, envelope):
+            received['messages'] += 1
+            return '250 OK'
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    controller = Controller(CountingHandler(), hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+                          MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_USERNAME=None,
+                          MAIL_PASSWORD=None, MAIL_SUPPRESS_SEND=False)
+        if workers is not None:
+            app.config['FLASKY_MAIL_WORKERS'] = workers
+        if batch_size is not None:
+            app.config['FLASKY_MAIL_BATCH_SIZE'] = batch_size
+        mail.init_app(app)
+        with app.app_context():
+            db.create_all()
+            db.session.bulk_insert_mappings(OutboxMessage, [
+                {'sender': 'bench@bench.local', 'recipients': 'user%d@bench.local' % i,
+                 'subject': 'bench %d' % i, 'body': 'hello', 'html': '<p>hello</p>',
+                 'attempts': 0, 'next_attempt': datetime.utcnow()} for i in range(messages)])
+            db.session.commit()
+            db.session.remove()
+
+        outbox = MailOutbox(app)
+        threads = [threading.Thread(target=outbox.drain) for i in range(outbox.workers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        controller.stop()
+
+    with app.app_context():
+        left = OutboxMessage.query.count()
+        db.session.remove()
+    return {'messages': messages,
+            'workers': outbox.workers,
+            'batch_size': outbox.batch_size,
+            'sent': messages - left,
+            'received': received['messages'],
+            'elapsed': elapsed,
+            'throughput': (messages - left) / elapsed}
+
+
+def bench_email_render(app, messages=1000, template='auth/email/confirm'):
+    """Time rendering `messages` confirmation mails with render_template(),
+    EmailRenderer.render() and EmailRenderer.render_many()."""
+    from flask import render_template
+
+    renderer = app.extensions['email_renderer']
+    contexts = [{'user': {'username': 'user%d' % i}, 'token': 'token%d' % i}
+                for i in range(messages)]
+    report = {'messages': messages, 'template': template}
+    with app.test_request_context('/'):
+        start = time.time()
+        for context in contexts:
+            render_template(template + '.txt', **context)
+            render_template(template + '.html', **context)
+        report['render_template'] = messages / (time.time() - start)
+        start = time.time()
+        for context in contexts:
+            renderer.render(template, **context)
+        report['render'] = messages / (time.time() - start)
+        start = time.time()
+        for pair in renderer.render_many(template, contexts):
+            pass
+        report['render_many'] = messages / (time.time() - start)
+    return report
+
+
+# one cycle over every combination of the index filter form
+INDEX_FILTERS = [{'status': status, 'start_time_order': start, 'capacity_order': capacity}
+                 for status in (0, 1, 2, 4) for start in (0, 1, 2) for capacity in (0, 1, 2)]
+
+
+def _route_plan(rng, usernames, activity_ids, locations, admin):
+    """(name, method, url, form data, signed in) for every route, each a
+    function of the request number so runs repeat exactly for one seed."""
+    def index(i):
+        return ('index', 'GET', '/', None, False)
+
+    def index_filtered(i):
+        args = dict(INDEX_FILTERS[i % len(INDEX_FILTERS)])
+        if i % 2:
+            args['location'] = rng.choice(locations)
+        return ('index (filters)', 'GET', '/?' + '&'.join('%s=%s' % item for item in sorted(args.items())),
+                None, False)
+
+    def index_joinable(i):
+        return ('index (joinable)', 'GET', '/?joinable=1', None, True)
+
+    def user(i):
+        return ('user', 'GET', '/user/' + rng.choice(usernames), None, False)
+
+    def activity(i):
+        return ('activity', 'GET', '/activity/%d' % rng.choice(activity_ids), None, False)
+
+    def participate(i):
+        return ('participate', 'GET', '/participate/%d' % rng.choice(activity_ids), None, True)
+
+    def publish(i):
+        begin = datetime.now() + timedelta(days=30 + i)
+        return ('publish', 'POST', '/publish/' + admin, {
+            'name': 'bench %d' % i, 'description': 'bench', 'location': 'bench hall',
+            'begin': begin.strftime('%Y/%m/%d/%H/%M'),
+            'end': (begin + timedelta(hours=2)).strftime('%Y/%m/%d/%H/%M'),
+            'capacity': 10}, True)
+
+    def follow(i):
+        # follow on even requests, unfollow the same user on odd ones
+        username = usernames[(i // 2) % len(usernames)]
+        return ('follow', 'GET', '/%s/%s' % ('unfollow' if i % 2 else 'follow', username),
+                None, True)
+
+    def moderate(i):
+        return ('moderate', 'GET', '/moderate', None, True)
+
+    return [index, index_filtered, index_joinable, user, activity, participate, publish,
+            follow, moderate]
+
+
+def bench_routes(app, scale=0.01, requests=50, seed=1):
+    """Seed a generate_bulk() dataset of `scale` and drive every main route
+    `requests` times through the test client, anonymously or as an
+    administrator as the route needs.
+
+    Reports p50/p95/p99 latency, queries per request and requests per
+    second for each route. Everything random derives from `seed`, so two
+    runs differ only in timing."""
+    import random
+    from .fake import generate_bulk
+    from .models import User, Role, Activity
+    from .perf import get_profiler, percentile
+
+    # queries per request come from the profiler, so profile every request
+    profiler = get_profiler(app)
+    profiler.sample_rate = 1.0
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        counts = generate_bulk(scale=scale, seed=seed)
+        admin = User(email='admin@bench.local', username='bench_admin', password='bench',
+                     confirmed=True)
+        admin.role = Role.query.filter_by(name='Administrator').first()
+        db.session.add(admin)
+        db.session.commit()
+        usernames = [name for name, in db.session.query(User.username).
+                     filter(User.id != admin.id).order_by(User.id).limit(1000)]
+        activity_ids = [id for id, in db.session.query(Activity.id).order_by(Activity.id).limit(1000)]
+        locations = [location for location, in db.session.query(Activity.location).distinct().
+                     order_by(Activity.location).limit(100)]
+        db.session.remove()
+
+    rng = random.Random(seed)
+    anonymous = app.test_client()
+    signed_in = app.test_client(use_cookies=True)
+    signed_in.post('/auth/login', data={'email': 'admin@bench.local', 'password': 'bench'})
+    report = {'scale': scale, 'seed': seed, 'requests': requests, 'rows': counts, 'routes': {}}
+    for route in _route_plan(rng, usernames, activity_ids, locations, 'bench_admin'):
+        # one unmeasured request first, so template compilation and cold
+        # caches do not land in the percentiles
+        name, method, url, data, signed = route(requests)
+        (signed_in if signed else anonymous).open(url, method=method, data=data)
+        profiler.records.clear()
+        latencies = []
+        statuses = Counter()
+        start = time.time()
+        for i in range(requests):
+            name, method, url, data, signed = route(i)
+            client = signed_in if signed else anonymous
+            began = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            latencies.append((time.perf_counter() - began) * 1000)
+            statuses[response.status_code] += 1
+            if signed:
+                # the redirects are not followed, so drop their flashes
+                # before they pile up in the session cookie
+                with client.session_transaction() as session:
+                    session.pop('_flashes', None)
+        elapsed = time.time() - start
+        latencies.sort()
+        queries = [record['queries'] for record in profiler.records]
+        report['routes'][name] = {
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'queries': sum(queries) / float(len(queries)) if queries else 0,
+            'max_queries': max(queries) if queries else 0,
+            'throughput': requests / elapsed,
+            'statuses': dict((str(status), count) for status, count in statuses.items()),
+        }
+    return report
+
+
+def compare_reports(report, baseline, tolerance=0.25, slack_ms=1.0):
+    """Regressions of `report` against `baseline` as readable strings: a
+    p95 latency more than `tolerance` (and `slack_ms`) above the baseline,
+    or more queries per request than before."""
+    regressions = []
+    for name, route in sorted(report['routes'].items()):
+        before = baseline.get('routes', {}).get(name)
+        if before is None:
+            continue
+        if route['p95_ms'] > before['p95_ms'] * (1 + tolerance) + slack_ms:
+            regressions.append('%s: p95 %.1fms, was %.1fms' % (name, route['p95_ms'], before['p95_ms']))
+        # participate and follow alternate between outcomes, so allow half a query
+        if route['queries'] > before['queries'] + 0.5:
+            regressions.append('%s: %.1f queries per request, was %.1f'
+                               % (name, route['queries'], before['queries']))
+    return regressions
@@ -1,20 +1,181 @@
-from threading import Thread
-from flask import current_app, render_template
-from flask_mail import Message
-from . import mail
+import threading
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_
+from . import db, mail
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class EmailRenderer(object):
+    """Renders the .txt and .html halves of a mail template together.
+
+    Both templates are looked up once and kept, unless the app reloads
+    templates (debug), and the template context is built once per call,
+    so render_many() only pays for the per-recipient variables."""
+
+    def __init__(self, app):
+        self.app = app
+        self._templates = {}
+
+    def _load(self, template):
+        env = self.app.jinja_env
+        if env.auto_reload:
+            return env.get_template(template + '.txt'), env.get_template(template + '.html')
+        pair = self._templates.get(template)
+        if pair is None:
+            pair = self._templates[template] = (env.get_template(template + '.txt'),
+                                                env.get_template(template + '.html'))
+        return pair
+
+    def render(self, template, **kwargs):
+        """Return (text, html)."""
+        return next(self.render_many(template, [kwargs]))
+
+    def render_many(self, template, contexts, **shared):
+        """Yield (text, html) for every dict in `contexts`, each merged over
+        the `shared` variables."""
+        text, html = self._load(template)
+        base = dict(shared)
+        self.app.update_template_context(base)
+        for context in contexts:
+            variables = dict(base)
+            variables.update(context)
+            yield text.render(variables), html.render(variables)
 
 
 def send_email(to, subject, template, **kwargs):
+    """Render the message and queue it in the outbox, where MailOutbox
+    delivers it; returns the queued OutboxMessage. Unlike the Thread this
+    used to return, there is nothing to join: delivery happens later."""
+    return send_bulk_email([to], subject, template, [kwargs])[0]
+
+
+def send_bulk_email(recipients, subject, template, contexts=None, **shared):
+    """Queue one message per address in `recipients`, rendered from the
+    matching dict in `contexts` on top of `shared`, with a single commit."""
+    from .models import OutboxMessage
+
     app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    if contexts is None:
+        contexts = [{}] * len(recipients)
+    subject = app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject
+    renderer = app.extensions['email_renderer']
+    messages = [OutboxMessage(sender=app.config['FLASKY_MAIL_SENDER'], recipients=to,
+                              subject=subject, body=body, html=html)
+                for to, (body, html) in zip(recipients,
+                                            renderer.render_many(template, contexts, **shared))]
+    db.session.add_all(messages)
+    db.session.commit()
+    wake_mail_outbox(app)
+    return messages
+
+
+class MailOutbox(object):
+    """A fixed pool of FLASKY_MAIL_WORKERS threads draining the outbox table.
+
+    Each worker claims up to FLASKY_MAIL_BATCH_SIZE due messages, sends them
+    over one SMTP connection and deletes the ones that went out. Failed
+    messages are retried after FLASKY_MAIL_RETRY_DELAY * 2 ** (attempts - 1)
+    seconds. Messages live in the database until sent, so a restart loses
+    nothing; a claim whose worker died is picked up again when its lease
+    runs out."""
+
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config['FLASKY_MAIL_WORKERS']
+        self.batch_size = app.config['FLASKY_MAIL_BATCH_SIZE']
+        self.max_attempts = app.config['FLASKY_MAIL_MAX_ATTEMPTS']
+        self.retry_delay = app.config['FLASKY_MAIL_RETRY_DELAY']
+        self.poll_interval = app.config['FLASKY_MAIL_POLL_INTERVAL']
+        self.lease_time = timedelta(seconds=app.config['FLASKY_MAIL_LEASE_TIME'])
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name='mail-outbox-%d' % len(self._threads))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _claim(self, now):
+        from .models import OutboxMessage
+
+        lease = uuid.uuid4().hex
+        due = and_(OutboxMessage.next_attempt <= now, OutboxMessage.attempts < self.max_attempts)
+        batch = db.session.query(OutboxMessage.id).filter(due). \
+            order_by(OutboxMessage.next_attempt, OutboxMessage.id).limit(self.batch_size)
+        # re-checking `due` keeps two workers from claiming the same row
+        OutboxMessage.query.filter(OutboxMessage.id.in_(batch.subquery()), due). \
+            update({'lease': lease, 'next_attempt': now + self.lease_time}, synchronize_session=False)
+        db.session.commit()
+        return OutboxMessage.query.filter_by(lease=lease).order_by(OutboxMessage.id).all()
+
+    def deliver(self):
+        """Send one batch and return (sent, failed)."""
+        now = datetime.utcnow()
+        with self.app.app_context():
+            try:
+                messages = self._claim(now)
+                if not messages:
+                    return 0, 0
+                sent, error, connected = [], None, False
+                try:
+                    with mail.connect() as connection:
+                        connected = True
+                        for message in messages:
+                            connection.send(message.to_message())
+                            sent.append(message)
+                except Exception as e:
+                    error = e
+                for message in sent:
+                    db.session.delete(message)
+                # a broken connection fails the whole batch; otherwise only
+                # the message that raised, and the rest goes out next round
+                failed = messages[len(sent):] if not connected else messages[len(sent):len(sent) + 1]
+                for message in failed:
+                    message.attempts += 1
+                    message.last_error = repr(error)
+                    if message.attempts >= self.max_attempts:
+                        # given up on; the row stays for inspection
+                        message.next_attempt = None
+                    else:
+                        message.next_attempt = datetime.utcnow() + timedelta(
+                            seconds=self.retry_delay * 2 ** (message.attempts - 1))
+                for message in messages[len(sent) + len(failed):]:
+                    message.next_attempt = now
+                for message in messages[len(sent):]:
+                    message.lease = None
+                db.session.commit()
+                return len(sent), len(failed)
+            finally:
+                db.session.remove()
+
+    def drain(self):
+        """Deliver until nothing is due; return the number of messages sent."""
+        total = 0
+        while True:
+            sent, failed = self.deliver()
+            total += sent
+            if not sent and not failed:
+                return total
+
+    def _run(self):
+        while True:
+            try:
+                sent, failed = self.deliver()
+            except Exception:
+                self.app.logger.exception('Mail outbox worker failed')
+                sent, failed = 0, 0
+            if not sent and not failed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+def wake_mail_outbox(app):
+    outbox = app.extensions.get('mail_outbox')
+    if outbox is not None:
+        outbox.wake()
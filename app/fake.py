@@ -0,0 +1,206 @@
+"""Bulk fake data for load testing.
+
+Everything is generated in memory with NumPy and written with
+bulk_insert_mappings() in batches, so a dataset with about a million
+enrollments (scale=1) takes minutes instead of days. The row-by-row
+generate_fake() methods on the models are still there for small, varied
+development data."""
+from datetime import datetime, timedelta
+from flask import current_app
+from . import db
+from .passwords import get_password_service
+
+# rows per unit of scale
+USERS = 50000
+ACTIVITIES = 50000
+LOCATIONS = 500
+FOLLOWS_PER_USER = 10
+COMMENT_RATE = 0.3
+
+COMMENT_BODIES = ["很有收获", "终于明白该吃啥了", "外币外币", "外币巴布", "浪费时间，差评", "很无聊，浪费时间",
+                  "谢谢,又被饿到", "研讨不错，能算学分就好了"]
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('the bulk fake data generator needs NumPy (pip install numpy)')
+    return numpy
+
+
+def _group_rank(np, keys):
+    """Position of every element of the sorted array `keys` within its run
+    of equal keys."""
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    lengths = np.diff(np.r_[starts, len(keys)])
+    return np.arange(len(keys)) - np.repeat(starts, lengths)
+
+
+def _to_datetimes(np, base, hours):
+    return (np.datetime64(base, 'us') +
+            (hours * 3600e6).astype('timedelta64[us]')).tolist()
+
+
+def _insert(model, rows, batch_size):
+    for i in range(0, len(rows), batch_size):
+        db.session.bulk_insert_mappings(model, rows[i:i + batch_size])
+    db.session.commit()
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _sync_sequences(models):
+    # explicit ids leave PostgreSQL's serial sequences behind
+    if db.engine.dialect.name == 'postgresql':
+        for model in models:
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                "(SELECT coalesce(max(id), 1) FROM %s))" % (model.__tablename__, model.__tablename__))
+        db.session.commit()
+
+
+def generate_bulk(scale=1.0, seed=None, batch_size=10000, now=None):
+    """Insert users, follows, activities, enrollments and comments and
+    return how many rows of each were written.
+
+    Activities never overlap at a venue, enrollments respect capacity,
+    never include the publisher and never overlap for a participant, and
+    the denormalized counters and status are filled in. The same `seed`
+    always produces the same data. Venue schedules are only checked against
+    each other, so run it against a database without fake activities.
+
+    `now` is local time, like begin/end and the status derived from them
+    everywhere else; the other timestamps are written in UTC."""
+    from .models import User, Follow, Activity, ActivityStatus, Enrollment, Comment
+
+    np = _numpy()
+    rng = np.random.RandomState(seed)
+    if now is None:
+        now = datetime.now()
+    utc_offset = (datetime.utcnow() - datetime.now()).total_seconds()
+    utc_now = now + timedelta(minutes=round(utc_offset / 60))
+    n_users = max(int(USERS * scale), 2)
+    n_activities = max(int(ACTIVITIES * scale), 1)
+    n_locations = max(int(LOCATIONS * scale), 1)
+
+    # users; one shared hash keeps this from being dominated by pbkdf2
+    first_user = _next_id(User)
+    user_ids = np.arange(first_user, first_user + n_users)
+    password_hash = get_password_service(current_app).hash('cat')
+    role_id = User.default_role_id(None)
+    member_since = _to_datetimes(np, utc_now - timedelta(days=365), rng.uniform(0, 24 * 365, n_users))
+    users = [{'id': int(user_id),
+              'email': 'robot%d@fake.local' % user_id,
+              'username': 'Robot_%d' % user_id,
+              'password_hash': password_hash,
+              'role_id': role_id,
+              'confirmed': True,
+              'about_me': 'i am NOT robot!',
+              'member_since': member_since[i],
+              'last_seen': member_since[i]} for i, user_id in enumerate(user_ids.tolist())]
+    _insert(User, users, batch_size)
+    del users
+
+    # follows, without self-follows or duplicates
+    follower = np.repeat(user_ids, FOLLOWS_PER_USER)
+    followed = user_ids[rng.randint(0, n_users, len(follower))]
+    follows = np.unique(np.stack([follower, followed], axis=1)[follower != followed], axis=0)
+    _insert(Follow, [{'follower_id': a, 'followed_id': b, 'timestamp': utc_now}
+                     for a, b in follows.tolist()], batch_size)
+
+    # activities: per venue, back to back with a gap of at least an hour, so
+    # no two activities at a venue overlap
+    location = np.sort(rng.randint(0, n_locations, n_activities))
+    duration = rng.randint(1, 11, n_activities).astype(float)
+    gap = rng.randint(1, 73, n_activities).astype(float)
+    step = gap + duration
+    total = np.cumsum(step)
+    rank = _group_rank(np, location)
+    group_offset = (total - step)[rank == 0]
+    begin = total - duration - np.repeat(group_offset, np.unique(location, return_counts=True)[1])
+    # start about 120 days ago so finished, ongoing and reserved all occur
+    begin_hours = begin - 24 * 120
+    end_hours = begin_hours + duration
+    publish_hours = np.minimum(begin_hours - rng.uniform(1, 24 * 30, n_activities), 0)
+    status = np.where(begin_hours > 0, ActivityStatus.RESERVED,
+                      np.where(end_hours > 0, ActivityStatus.ONGOING, ActivityStatus.FINISHED))
+    capacity = rng.randint(10, 101, n_activities)
+    publisher = user_ids[rng.randint(0, n_users, n_activities)]
+
+    # enrollments: draw candidates, drop duplicates and publishers, then keep
+    # a candidate only if it starts after everything its participant was
+    # offered before (a segmented running max of end times), then cut every
+    # activity down to its target fill
+    target = np.floor(capacity * rng.uniform(0, 1, n_activities)).astype(int)
+    activity_idx = np.repeat(np.arange(n_activities), np.ceil(target * 1.5).astype(int))
+    participant = user_ids[rng.randint(0, n_users, len(activity_idx))]
+    keep = participant != publisher[activity_idx]
+    activity_idx, participant = activity_idx[keep], participant[keep]
+    pairs = np.unique(np.stack([participant, activity_idx], axis=1), axis=0)
+    participant, activity_idx = pairs[:, 0], pairs[:, 1]
+    order = np.lexsort((begin_hours[activity_idx], participant))
+    participant, activity_idx = participant[order], activity_idx[order]
+    span = end_hours.max() - begin_hours.min() + 1
+    user_offset = (participant - first_user) * span
+    running_end = np.maximum.accumulate(user_offset + end_hours[activity_idx] - begin_hours.min())
+    keep = np.r_[True, user_offset[1:] + begin_hours[activity_idx[1:]] - begin_hours.min() >
+                 running_end[:-1]]
+    participant, activity_idx = participant[keep], activity_idx[keep]
+    order = np.lexsort((rng.uniform(0, 1, len(activity_idx)), activity_idx))
+    participant, activity_idx = participant[order], activity_idx[order]
+    keep = _group_rank(np, activity_idx) < target[activity_idx]
+    participant, activity_idx = participant[keep], activity_idx[keep]
+    enrolled_count = np.bincount(activity_idx, minlength=n_activities)
+
+    # comments from a share of the participants of finished activities
+    commented = (status[activity_idx] == ActivityStatus.FINISHED) & \
+        (rng.uniform(0, 1, len(activity_idx)) < COMMENT_RATE)
+    comment_activity, comment_author = activity_idx[commented], participant[commented]
+    comment_count = np.bincount(comment_activity, minlength=n_activities)
+
+    first_activity = _next_id(Activity)
+    begins = _to_datetimes(np, now, begin_hours)
+    ends = _to_datetimes(np, now, end_hours)
+    publishes = _to_datetimes(np, utc_now, publish_hours)
+    activities = [{'id': first_activity + i,
+                   'publisher_id': publisher_id,
+                   'publish_timestamp': publishes[i],
+                   'begin_timestamp': begins[i],
+                   'end_timestamp': ends[i],
+                   'location': 'Venue %d' % location_id,
+                   'name': 'Load test seminar %d' % (first_activity + i),
+                   'description': "到底那个更合适呢？快来讨论呀~",
+                   'capacity': capacity_,
+                   'disabled': False,
+                   'enrolled_count': enrolled_,
+                   'comment_count': comments_,
+                   'status': status_}
+                  for i, (publisher_id, location_id, capacity_, enrolled_, comments_, status_) in
+                  enumerate(zip(publisher.tolist(), location.tolist(), capacity.tolist(),
+                                enrolled_count.tolist(), comment_count.tolist(), status.tolist()))]
+    _insert(Activity, activities, batch_size)
+    del activities
+
+    # enrolled between publishing and the start (or now, if earlier)
+    enroll_hours = publish_hours[activity_idx] + rng.uniform(0, 1, len(activity_idx)) * \
+        (np.minimum(begin_hours[activity_idx], 0) - publish_hours[activity_idx])
+    timestamps = _to_datetimes(np, utc_now, enroll_hours)
+    _insert(Enrollment, [{'activity_id': first_activity + a, 'participant_id': p, 'timestamp': t}
+                         for a, p, t in zip(activity_idx.tolist(), participant.tolist(), timestamps)],
+            batch_size)
+
+    comment_hours = end_hours[comment_activity] + rng.uniform(0, 72, len(comment_activity))
+    timestamps = _to_datetimes(np, utc_now, comment_hours)
+    bodies = rng.randint(0, len(COMMENT_BODIES), len(comment_activity)).tolist()
+    _insert(Comment, [{'activity_id': first_activity + a, 'author_id': u, 'timestamp': t,
+                       'body': COMMENT_BODIES[b], 'disabled': False}
+                      for a, u, t, b in zip(comment_activity.tolist(), comment_author.tolist(),
+                                            timestamps, bodies)],
+            batch_size)
+
+    _sync_sequences([User, Activity])
+    return {'users': n_users, 'follows': len(follows), 'activities': n_activities,
+            'enrollments': len(activity_idx), 'comments': len(comment_activity)}
@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import current_app, make_response, render_template, request, session
+from flask_login import current_user
+
+
+class PageCache(object):
+    """Rendered pages for anonymous visitors, keyed by ETag.
+
+    An ETag already covers the data a page shows, so a stale entry simply
+    stops being asked for. The cache is still emptied whenever this process
+    writes activities, enrollments or comments, in case a page shows
+    something its ETag does not cover."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            body = self._pages.get(etag)
+            if body is not None:
+                self._pages.move_to_end(etag)
+            return body
+
+    def set(self, etag, body):
+        with self._lock:
+            self._pages[etag] = body
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+
+
+def invalidate_page_cache(app):
+    cache = app.extensions.get('page_cache')
+    if cache is not None:
+        cache.invalidate()
+
+
+def render_cached(parts, template, **context):
+    """render_template() for pages that anonymous visitors see alike.
+
+    `parts` must capture everything the page shows, e.g. the ids, counters
+    and timestamps of the listed rows plus the filter. For anonymous
+    visitors without pending flash messages it becomes the ETag: a matching
+    If-None-Match is answered with 304 and a known ETag with the cached
+    page, both without rendering. Anyone else gets a plain render."""
+    cache = current_app.extensions.get('page_cache')
+    if cache is None or current_user.is_authenticated or '_flashes' in session:
+        return render_template(template, **context)
+    etag = hashlib.md5(repr((request.full_path, parts)).encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        body = cache.get(etag)
+        if body is None:
+            body = render_template(template, **context)
+            cache.set(etag, body)
+        response = make_response(body)
+    response.set_etag(etag)
+    # pages differ once logged in, and browsers should always revalidate
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
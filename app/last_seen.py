@@ -0,0 +1,82 @@
+import atexit
+import threading
+import time
+from sqlalchemy import and_, bindparam, or_, text
+from . import db
+
+
+class LastSeenBuffer(object):
+    """Collects User.last_seen values from ping() and writes them in one
+    batched UPDATE every FLASKY_LAST_SEEN_FLUSH_INTERVAL seconds, so
+    read-only requests no longer open write transactions."""
+    chunk_size = 500
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['FLASKY_LAST_SEEN_FLUSH_INTERVAL']
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, user_id, timestamp):
+        with self._lock:
+            if timestamp > self._pending.get(user_id, timestamp.min):
+                self._pending[user_id] = timestamp
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='last-seen-flush')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def flush(self):
+        """Write the buffered values and return how many were pending."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = sorted(pending.items())
+        with self.app.app_context():
+            try:
+                for i in range(0, len(rows), self.chunk_size):
+                    self._update(rows[i:i + self.chunk_size])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                for user_id, timestamp in rows:
+                    self.record(user_id, timestamp)
+                raise
+            finally:
+                db.session.remove()
+        return len(rows)
+
+    def _update(self, rows):
+        if db.engine.dialect.name == 'postgresql':
+            values = ', '.join('(CAST(:id%d AS INTEGER), CAST(:ts%d AS TIMESTAMP))' % (i, i)
+                               for i in range(len(rows)))
+            params = {}
+            for i, (user_id, timestamp) in enumerate(rows):
+                params['id%d' % i] = user_id
+                params['ts%d' % i] = timestamp
+            db.session.execute(text(
+                'UPDATE users SET last_seen = v.last_seen FROM (VALUES %s) AS v (id, last_seen) '
+                'WHERE users.id = v.id AND (users.last_seen IS NULL OR users.last_seen < v.last_seen)'
+                % values), params)
+        else:
+            from .models import User
+            users = User.__table__
+            db.session.execute(
+                users.update().
+                where(and_(users.c.id == bindparam('user_id'),
+                           or_(users.c.last_seen.is_(None), users.c.last_seen < bindparam('ts')))).
+                values(last_seen=bindparam('ts')),
+                [{'user_id': user_id, 'ts': timestamp} for user_id, timestamp in rows])
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Flushing last_seen updates failed')
@@ -3,8 +3,10 @@ from wtforms import StringField, TextAreaField, BooleanField, SelectField, \
     SubmitField, DateTimeField, IntegerField
 from wtforms.validators import Required, Length, Email, Regexp, Optional
 from wtforms import ValidationError
-from ..models import Role, User, ActivityStatus
+from ..models import Role, User, ActivityStatus, ActivityQuery
 from datetime import datetime
+from collections import namedtuple
+from urllib.parse import urlencode
 
 
 class NameForm(FlaskForm):
@@ -79,7 +81,94 @@ class FilterCapacityOrder(FilterStartTimeOrder):
     pass
 
 
+filter_status_to_str = {
+    FilterStatus.ALL: "all",
+    FilterStatus.RESERVED: "reserved",
+    FilterStatus.ONGOING: "ongoing",
+    FilterStatus.FINISHED: "finished"
+}
+
+filter_time_order_to_str = {
+    FilterStartTimeOrder.DEFAULT: "default",
+    FilterStartTimeOrder.DES: "descending",
+    FilterStartTimeOrder.ASC: "ascending",
+}
+filter_capacity_order_to_str = {
+    FilterCapacityOrder.DEFAULT: "default",
+    FilterCapacityOrder.DES: "descending",
+    FilterCapacityOrder.ASC: "ascending"
+}
+
+
+class ActivityFilter(namedtuple('ActivityFilter',
+                                ['status', 'start_time_order', 'capacity_order', 'location',
+                                 'joinable'])):
+    """Immutable, hashable filter for the activity list.
+
+    It travels in the query string, so every request carries its own filter
+    and equal filters compare and hash equal, which makes the value usable
+    as a cache key."""
+    __slots__ = ()
+
+    def __new__(cls, status=FilterStatus.ALL, start_time_order=FilterStartTimeOrder.DEFAULT,
+                capacity_order=FilterCapacityOrder.DEFAULT, location='', joinable=False):
+        return super(ActivityFilter, cls).__new__(cls, status, start_time_order,
+                                                  capacity_order, location.strip(), bool(joinable))
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a filter from request arguments, falling back to the
+        default for anything missing or unknown."""
+        def choice(name, allowed, default):
+            value = args.get(name, default, type=int)
+            return value if value in allowed else default
+
+        return cls(status=choice('status', filter_status_to_str, FilterStatus.ALL),
+                   start_time_order=choice('start_time_order', filter_time_order_to_str,
+                                           FilterStartTimeOrder.DEFAULT),
+                   capacity_order=choice('capacity_order', filter_capacity_order_to_str,
+                                         FilterCapacityOrder.DEFAULT),
+                   location=args.get('location', '')[:64],
+                   joinable=args.get('joinable', '') not in ('', '0', 'False', 'false'))
+
+    def to_args(self):
+        """Query string arguments for this filter, defaults left out."""
+        default = ActivityFilter()
+        return dict((name, value) for name, value in self._asdict().items()
+                    if value != getattr(default, name))
+
+    @property
+    def cache_key(self):
+        return urlencode(sorted(self._asdict().items()))
+
+    def activity_query(self, user=None):
+        """The ActivityQuery this filter selects; `joinable` needs the
+        signed-in `user` and is ignored without one."""
+        status = {FilterStatus.RESERVED: ActivityStatus.RESERVED,
+                  FilterStatus.ONGOING: ActivityStatus.ONGOING,
+                  FilterStatus.FINISHED: ActivityStatus.FINISHED}.get(self.status)
+        direction = {FilterStartTimeOrder.ASC: ActivityQuery.ASC,
+                     FilterStartTimeOrder.DES: ActivityQuery.DESC}
+        activity_query = ActivityQuery(status=status, location=self.location or None,
+                                       begin_order=direction.get(self.start_time_order),
+                                       capacity_order=direction.get(self.capacity_order))
+        if self.joinable and user is not None and user.is_authenticated:
+            activity_query = activity_query.joinable_by(user)
+        return activity_query
+
+    def describe(self):
+        return "now the fileter is {" + "status: " + filter_status_to_str[self.status] + \
+               ", time order: " + filter_time_order_to_str[self.start_time_order] + \
+               ", capacity order: " + filter_capacity_order_to_str[self.capacity_order] + \
+               ", location: " + (self.location or "all") + \
+               (", joinable only" if self.joinable else "") + "}"
+
+
 class FilterForm(FlaskForm):
+    class Meta:
+        # submitted with GET so the filter lives in the URL
+        csrf = False
+
     status = SelectField('status：', choices=[
         (FilterStatus.ALL, 'All'),
         (FilterStatus.RESERVED, 'Reserved'),
@@ -97,6 +186,7 @@ class FilterForm(FlaskForm):
                                           (FilterCapacityOrder.DES, 'Descending'),
                                           (FilterCapacityOrder.ASC, 'Ascending')],
                                  coerce=int)
+    joinable = BooleanField('Only activities I can join')
     confirm = SubmitField('Confirm')
 
 
@@ -1,132 +1,113 @@
-from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response
+import re
+from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response, \
+    jsonify
 from flask_login import login_required, current_user
 from . import main
-from .forms import EditProfileForm, EditProfileAdminForm, ActivityForm, FilterForm, FilterStatus, \
-    FilterStartTimeOrder, FilterCapacityOrder, CommentForm
+from .forms import EditProfileForm, EditProfileAdminForm, ActivityForm, FilterForm, CommentForm, \
+    ActivityFilter
 from .. import db
-from ..models import Role, User, Permission, Activity, Enrollment, ActivityStatus, Comment
+from ..models import User, Follow, Permission, Activity, Enrollment, EnrollmentResult, Comment
 from ..decorators import admin_required, permission_required
+from ..pagination import paginate_keyset
+from ..scheduler import wake_status_scheduler
+from ..timeline import get_timeline, fan_out_activity, refresh_timeline
+from ..avatars import get_avatar_cache, mimetype_of
+from ..http_cache import render_cached, invalidate_page_cache
+from ..perf import get_profiler
 from datetime import datetime
-from flask_sqlalchemy import get_debug_queries
-
-filter = {'status': FilterStatus.ALL,
-          'start_time_order': FilterStartTimeOrder.DEFAULT,
-          'capacity_order': FilterCapacityOrder.DEFAULT,
-          'location': ''}
-filter_status_to_str = {
-    FilterStatus.ALL: "all",
-    FilterStatus.RESERVED: "reserved",
-    FilterStatus.ONGOING: "ongoing",
-    FilterStatus.FINISHED: "finished"
+from sqlalchemy.orm import joinedload
+
+enrollment_result_to_str = {
+    EnrollmentResult.SUCCEED: "Participate Succeed!",
+    EnrollmentResult.ONGOING: "Pariticipation Failed!because this activity is ongoing.",
+    EnrollmentResult.FINISHED: "Pariticipation Failed!because this activity is finished.",
+    EnrollmentResult.PUBLISHER: "Pariticipation Failed!because you are the publisher of this activity.",
+    EnrollmentResult.FULL: "Pariticipation Failed!because this activity is full.",
+    EnrollmentResult.DUPLICATE: "Pariticipation Failed!because you have already participated it.",
+    EnrollmentResult.TIME_CONFLICT: "Pariticipation Failed!because you are not availiable at that time."
 }
 
-filter_time_order_to_str = {
-    FilterStartTimeOrder.DEFAULT: "default",
-    FilterStartTimeOrder.DES: "descending",
-    FilterStartTimeOrder.ASC: "ascending",
-}
-filter_capacity_order_to_str = {
-    FilterCapacityOrder.DEFAULT: "default",
-    FilterCapacityOrder.DES: "descending",
-    FilterCapacityOrder.ASC: "ascending"
-}
+
+def activity_etag_parts(activities):
+    return [(a.id, a.publisher.id, a.publisher.username, a.publisher.avatar_hash, a.name, a.status,
+             a.enrolled_count, a.publish_timestamp, a.begin_timestamp, a.end_timestamp, a.location,
+             a.description, a.capacity, a.comment_count) for a in activities]
 
 
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration,
-                   query.context))
-    return response
+def pagination_etag_parts(pagination):
+    if hasattr(pagination, 'next_cursor'):
+        return pagination.has_prev, pagination.has_next, pagination.prev_cursor, pagination.next_cursor
+    return pagination.page, pagination.pages
 
 
-@main.route('/', methods=['GET', 'POST'])
+@main.route('/_perf')
+@login_required
+@admin_required
+def perf():
+    profiler = get_profiler(current_app)
+    if profiler is None:
+        abort(404)
+    return jsonify(profiler.summary(recent=request.args.get('recent', 20, type=int)))
+
+
+@main.route('/')
 def index():
-    filter_form = FilterForm()
+    activity_filter = ActivityFilter.from_args(request.args)
+    filter_form = FilterForm(formdata=None, **activity_filter._asdict())
 
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+    activity_query = activity_filter.activity_query(current_user)
     if show_followed:
-        query = current_user.followed_activities
-    else:
-        query = Activity.query
-
-    if filter_form.validate_on_submit():
-        filter['status'] = filter_form.data['status']
-        filter['start_time_order'] = filter_form.data['start_time_order']
-        filter['capacity_order'] = filter_form.data['capacity_order']
-        filter['location'] = filter_form.data['location']
-
-    if filter['status'] == FilterStatus.ALL:
-        pass
-    elif filter['status'] == FilterStatus.RESERVED:
-        query = query.filter(Activity.begin_timestamp > datetime.now())
-    elif filter['status'] == FilterStatus.ONGOING:
-        query = query.filter(Activity.end_timestamp >= datetime.now()). \
-            filter(Activity.begin_timestamp <= datetime.now())
-    elif filter['status'] == FilterStatus.FINISHED:
-        query = query.filter(Activity.end_timestamp < datetime.now())
-    else:
-        raise ValueError
-
-    if filter['location'].__len__() == 0:
-        pass
-    else:
-        query = query.filter_by(location=filter['location'])
-
-    if filter['start_time_order'] == FilterStartTimeOrder.DEFAULT:
-        if filter['capacity_order'] == FilterCapacityOrder.DEFAULT:
-            pass
-        elif filter['capacity_order'] == FilterCapacityOrder.ASC:
-            query = query.order_by(Activity.capacity)
-        elif filter['capacity_order'] == FilterCapacityOrder.DES:
-            query = query.order_by(Activity.capacity.desc())
-        else:
-            raise ValueError
-    elif filter['start_time_order'] == FilterStartTimeOrder.ASC:
-        if filter['capacity_order'] == FilterCapacityOrder.DEFAULT:
-            query = query.order_by(Activity.begin_timestamp)
-        elif filter['capacity_order'] == FilterCapacityOrder.ASC:
-            query = query.order_by(Activity.begin_timestamp, Activity.capacity)
-        elif filter['capacity_order'] == FilterCapacityOrder.DES:
-            query = query.order_by(Activity.begin_timestamp, Activity.capacity.desc())
-        else:
-            raise ValueError
-    elif filter['start_time_order'] == FilterStartTimeOrder.DES:
-        if filter['capacity_order'] == FilterCapacityOrder.DEFAULT:
-            query = query.order_by(Activity.begin_timestamp.desc())
-        elif filter['capacity_order'] == FilterCapacityOrder.ASC:
-            query = query.order_by(Activity.begin_timestamp.desc(), Activity.capacity)
-        elif filter['capacity_order'] == FilterCapacityOrder.DES:
-            query = query.order_byActivity.begin_timestamp.desc(), (Activity.capacity.desc())
-        else:
-            raise ValueError
-    else:
-        raise ValueError
-
-    pagination = query.paginate(
-        page, per_page=current_app.config['FLASKY_ACTIVITIES_PER_PAGE'],
-        error_out=False)
+        activity_query = activity_query.followed_by(current_user)
+
+    per_page = current_app.config['FLASKY_ACTIVITIES_PER_PAGE']
+    pagination = None
+    timeline = get_timeline(current_app)
+    if show_followed and timeline is not None and activity_filter == ActivityFilter():
+        pagination = timeline.paginate(current_user, per_page)
+    if pagination is None:
+        pagination = paginate_keyset(
+            activity_query.query().options(joinedload(Activity.publisher)), activity_query.order_by(),
+            per_page=per_page)
     activities = pagination.items
-    if filter['location'].__len__() == 0:
-        fliter_prompt = "now the fileter is {" + "status: " + filter_status_to_str[filter['status']] + \
-                        ", time order: " + filter_time_order_to_str[filter['start_time_order']] + \
-                        ", capacity order: " + filter_capacity_order_to_str[filter['capacity_order']] + \
-                        ", location: all}"
-    else:
-        fliter_prompt = "now the fileter is {" + "status: " + filter_status_to_str[filter['status']] + \
-                        ", time order: " + filter_time_order_to_str[filter['start_time_order']] + \
-                        ", capacity order: " + filter_capacity_order_to_str[filter['capacity_order']] + \
-                        ", location: " + filter['location'] + "}"
-    flash(fliter_prompt)
-    return render_template('index.html', filter_form=filter_form, activities=activities,
-                           show_followed=show_followed,
-                           pagination=pagination)
+    return render_cached((activity_filter.cache_key, activity_etag_parts(activities),
+                          pagination_etag_parts(pagination)),
+                         'index.html', filter_form=filter_form, activities=activities,
+                         show_followed=show_followed, filter_args=activity_filter.to_args(),
+                         filter_description=activity_filter.describe(), pagination=pagination)
+
+
+@main.route('/activities.json')
+def activities_json():
+    activity_filter = ActivityFilter.from_args(request.args)
+    activity_query = activity_filter.activity_query(current_user)
+    pagination = paginate_keyset(
+        activity_query.query().options(joinedload(Activity.publisher)), activity_query.order_by(),
+        per_page=current_app.config['FLASKY_ACTIVITIES_PER_PAGE'])
+    return jsonify({
+        'activities': [activity.to_json() for activity in pagination.items],
+        'prev': url_for('.activities_json', before=pagination.prev_cursor, _external=True,
+                        **activity_filter.to_args()) if pagination.prev_cursor else None,
+        'next': url_for('.activities_json', after=pagination.next_cursor, _external=True,
+                        **activity_filter.to_args()) if pagination.next_cursor else None
+    })
+
+
+@main.route('/avatar/<hash>/<int:size>')
+def avatar(hash, size):
+    if not re.fullmatch(r'[0-9a-fA-F]{32}', hash) or \
+            not 0 < size <= current_app.config['FLASKY_AVATAR_MAX_SIZE']:
+        abort(404)
+    data, cached = get_avatar_cache(current_app).get(hash.lower(), size)
+    response = make_response(data)
+    response.mimetype = mimetype_of(data)
+    response.cache_control.public = True
+    # a fallback drawn because Gravatar was unreachable is only kept briefly
+    response.cache_control.max_age = current_app.config['FLASKY_AVATAR_MAX_AGE'] if cached else 60
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @main.route('/user/<username>')
@@ -134,12 +115,18 @@ def user(username):
     user = User.query.filter_by(username=username).first()
     if user is None:
         abort(404)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.activities.order_by(Activity.publish_timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_ACTIVITIES_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_keyset(
+        user.activities.filter(Activity.disabled.isnot(True)).options(joinedload(Activity.publisher)),
+        [Activity.publish_timestamp.desc(), Activity.id.desc()],
+        per_page=current_app.config['FLASKY_ACTIVITIES_PER_PAGE'])
     activities = pagination.items
-    return render_template('user.html', user=user, activities=activities, pagination=pagination)
+    counts = user.profile_counts()
+    return render_cached(((user.id, user.username, user.email, user.name, user.location,
+                           user.about_me, user.avatar_hash, user.member_since, user.last_seen),
+                          tuple(counts), activity_etag_parts(activities),
+                          pagination_etag_parts(pagination)),
+                         'user.html', user=user, activities=activities, pagination=pagination,
+                         counts=counts)
 
 
 @main.route('/publish/<username>', methods=['GET', 'POST'])
@@ -157,12 +144,10 @@ def publish(username):
         elif publish_form.end.data.__sub__(publish_form.begin.data).days >= 1:
             flash("this activity is too long")
             return redirect(url_for('.publish', username=username))
-        same_place_activities = Activity.query.filter_by(location=publish_form.location.data).all()
-        for same_place_activity in same_place_activities:
-            if not (same_place_activity.begin_timestamp.__gt__(publish_form.end.data)
-                    or same_place_activity.end_timestamp.__lt__(publish_form.begin.data)):
-                flash("conflicts with previously reserved activity, please change location or time!")
-                return redirect(url_for('.publish', username=username))
+        if Activity.find_venue_conflict(publish_form.location.data,
+                                        publish_form.begin.data, publish_form.end.data) is not None:
+            flash("conflicts with previously reserved activity, please change location or time!")
+            return redirect(url_for('.publish', username=username))
         activity = Activity(publisher=current_user._get_current_object(),
                             begin_timestamp=publish_form.begin.data,
                             end_timestamp=publish_form.end.data,
@@ -171,6 +156,10 @@ def publish(username):
                             description=publish_form.description.data,
                             capacity=publish_form.capacity.data)
         db.session.add(activity)
+        db.session.commit()
+        fan_out_activity(current_app, activity)
+        invalidate_page_cache(current_app)
+        wake_status_scheduler(current_app._get_current_object())
         flash("Publish success")
         return redirect(url_for('.index'))
     return render_template('publish.html', publish_form=publish_form, username=username)
@@ -203,7 +192,7 @@ def edit_profile_admin(id):
         user.email = form.email.data
         user.username = form.username.data
         user.confirmed = form.confirmed.data
-        user.role = Role.query.get(form.role.data)
+        user.role_id = form.role.data
         user.name = form.name.data
         user.location = form.location.data
         user.about_me = form.about_me.data
@@ -222,7 +211,9 @@ def edit_profile_admin(id):
 
 @main.route('/activity/<int:id>', methods=['GET', 'POST'])
 def activity(id):
-    activity_arg = Activity.query.get_or_404(id)
+    activity_arg = Activity.query.options(joinedload(Activity.publisher)).get_or_404(id)
+    if activity_arg.disabled:
+        abort(404)
     form = CommentForm()
     if form.validate_on_submit():
         enrollment_record = Enrollment.query.filter_by(activity_id=id).filter_by(
@@ -240,24 +231,41 @@ def activity(id):
                           activity=activity_arg,
                           author=current_user._get_current_object())
         db.session.add(comment)
+        invalidate_page_cache(current_app)
         flash('Your comment has been published.')
-        return redirect(url_for('.activity', id=activity_arg.id, page=1))
+        return redirect(url_for('.activity', id=activity_arg.id, comment_page=-1))
     page = request.args.get('page', 1, type=int)
-    pagination = Enrollment.query.filter_by(activity_id=id).paginate(
+    pagination = Enrollment.participant_query(id).paginate(
         page, per_page=current_app.config['FLASKY_PARTICIPANTS_PER_PAGE'],
         error_out=False)
-    participants = [{'user': item.participant_id, 'timestamp': item.timestamp}
-                    for item in pagination.items]
-    comments = activity_arg.comments.order_by(Comment.timestamp.asc()).all()
-    return render_template('activity.html', activities=[activity_arg], pagination=pagination,
-                           participants=participants, User=User, endpoint='.activity', endpoint_id=id,
-                           form=form, comments=comments)
+    participants = [{'user': user, 'timestamp': enrollment.timestamp}
+                    for enrollment, user in pagination.items]
+    comment_page = request.args.get('comment_page', 1, type=int)
+    if comment_page == -1:
+        comment_page = (activity_arg.comment_count - 1) // \
+            current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
+    comment_pagination = activity_arg.comments.options(joinedload(Comment.author)). \
+        order_by(Comment.timestamp.asc()).paginate(
+        comment_page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+        error_out=False)
+    comments = comment_pagination.items
+    return render_cached((activity_etag_parts([activity_arg]),
+                          [(p['user'].username, p['user'].avatar_hash, p['timestamp'])
+                           for p in participants], pagination_etag_parts(pagination),
+                          [(c.id, c.body, c.body_html, c.timestamp, c.disabled,
+                            c.author.username, c.author.avatar_hash) for c in comments],
+                          pagination_etag_parts(comment_pagination)),
+                         'activity.html', activities=[activity_arg], pagination=pagination,
+                         participants=participants, endpoint='.activity', endpoint_id=id,
+                         form=form, comments=comments, comment_pagination=comment_pagination)
 
 
 @main.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
     activity = Activity.query.get_or_404(id)
+    if activity.disabled:
+        abort(404)
     if current_user != activity.publisher and \
             not current_user.can(Permission.ADMINISTER):
         abort(403)
@@ -274,21 +282,20 @@ def edit(id):
             flash("this activity is too long")
             return render_template('edit_activity.html', form=form)
 
-        same_place_activities = Activity.query.filter_by(location=form.location.data).all()
-        for same_place_activity in same_place_activities:
-            if not (same_place_activity.begin_timestamp.__gt__(form.end.data)
-                    or same_place_activity.end_timestamp.__lt__(form.begin.data)):
-                flash("conflicts with previously reserved activity, please change location or time!")
-                return render_template('edit_activity.html', form=form)
+        if Activity.find_venue_conflict(form.location.data, form.begin.data, form.end.data,
+                                        exclude_id=activity.id) is not None:
+            flash("conflicts with previously reserved activity, please change location or time!")
+            return render_template('edit_activity.html', form=form)
 
-        activity = Activity(publisher=current_user._get_current_object(),
-                            begin_timestamp=form.begin.data,
-                            end_timestamp=form.end.data,
-                            location=form.location.data,
-                            name=form.name.data,
-                            description=form.description.data,
-                            capacity=form.capacity.data)
+        activity.begin_timestamp = form.begin.data
+        activity.end_timestamp = form.end.data
+        activity.location = form.location.data
+        activity.name = form.name.data
+        activity.description = form.description.data
+        activity.capacity = form.capacity.data
         db.session.add(activity)
+        invalidate_page_cache(current_app)
+        wake_status_scheduler(current_app._get_current_object())
         flash("Update success")
         return redirect(url_for(".activity", id=id))
     return render_template('edit_activity.html', form=form)
@@ -297,21 +304,12 @@ def edit(id):
 @main.route('/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
 def delete(id):
-    activities = Activity.query.filter_by(id=id).all()
-    enrollments = Enrollment.query.filter_by(activity_id=id).all()
-    comments = Comment.query.filter_by(activity_id=id).all()
-
-    for enrollment in enrollments:
-        db.session.delete(enrollment)
-        db.session.commit()
-
-    for activity in activities:
-        db.session.delete(activity)
-        db.session.commit()
-
-    for comment in comments:
-        db.session.delete(comment)
-        db.session.commit()
+    activity = Activity.query.get_or_404(id)
+    if current_user != activity.publisher and \
+            not current_user.can(Permission.ADMINISTER):
+        abort(403)
+    Activity.delete_many([id], soft=current_app.config['FLASKY_ACTIVITY_SOFT_DELETE'])
+    invalidate_page_cache(current_app)
     flash("Activity delete succeed!")
     return redirect(url_for(".index"))
 
@@ -328,6 +326,8 @@ def follow(username):
         flash('You are already following this user.')
         return redirect(url_for('.user', username=username))
     current_user.follow(user)
+    db.session.commit()
+    refresh_timeline(current_app, current_user)
     flash('You are now following %s.' % username)
     return redirect(url_for('.user', username=username))
 
@@ -344,6 +344,8 @@ def unfollow(username):
         flash('You are not following this user.')
         return redirect(url_for('.user', username=username))
     current_user.unfollow(user)
+    db.session.commit()
+    refresh_timeline(current_app, current_user)
     flash('You are not following %s anymore.' % username)
     return redirect(url_for('.user', username=username))
 
@@ -354,15 +356,17 @@ def followers(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_keyset(
+        user.followers, [Follow.timestamp.desc(), Follow.follower_id.desc()],
+        per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
-    return render_template('followers.html', user=user, title="Followers of",
-                           endpoint='.followers', pagination=pagination,
-                           follows=follows)
+    return render_cached(((user.id, user.username),
+                          [(f['user'].username, f['user'].avatar_hash, f['timestamp'])
+                           for f in follows], pagination_etag_parts(pagination)),
+                         'followers.html', user=user, title="Followers of",
+                         endpoint='.followers', pagination=pagination,
+                         follows=follows)
 
 
 @main.route('/followed-by/<username>')
@@ -371,15 +375,17 @@ def followed_by(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_keyset(
+        user.followed, [Follow.timestamp.desc(), Follow.followed_id.desc()],
+        per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
-    return render_template('followers.html', user=user, title="Followed by",
-                           endpoint='.followed_by', pagination=pagination,
-                           follows=follows)
+    return render_cached(((user.id, user.username),
+                          [(f['user'].username, f['user'].avatar_hash, f['timestamp'])
+                           for f in follows], pagination_etag_parts(pagination)),
+                         'followers.html', user=user, title="Followed by",
+                         endpoint='.followed_by', pagination=pagination,
+                         follows=follows)
 
 
 @main.route('/all')
@@ -402,60 +408,25 @@ def show_followed():
 @login_required
 def participate(id):
     activity = Activity.query.get_or_404(id)
-
-    def is_time_conflict():
-        activities_of_participant = Enrollment.query. \
-            filter_by(participant_id=current_user._get_current_object().id).all()
-        for activity_of_participant in activities_of_participant:
-            if activity.end_timestamp.__lt__(activity_of_participant.activity.begin_timestamp) or \
-                    activity.begin_timestamp.__gt__(activity_of_participant.activity.end_timestamp):
-                continue
-            else:
-                return True
-        return False
-
-    if activity._get_status() == ActivityStatus.ONGOING:
-        flash("Pariticipation Failed!because this activity is ongoing.")
-        return redirect(url_for('.activity', id=id))
-
-    elif activity._get_status() == ActivityStatus.FINISHED:
-        flash("Pariticipation Failed!because this activity is finished.")
-        return redirect(url_for('.activity', id=id))
-
-    elif current_user == activity.publisher:
-        flash("Pariticipation Failed!because you are the publisher of this activity.")
-        return redirect(url_for('.activity', id=id))
-
-    elif Enrollment.query.filter_by(activity_id=id).count() >= activity.capacity:
-        flash("Pariticipation Failed!because this activity is full.")
-        return redirect(url_for('.activity', id=id))
-    elif Enrollment.query.filter_by(activity_id=id). \
-            filter_by(participant_id=current_user._get_current_object().id).all().__len__():
-        flash("Pariticipation Failed!because you have already participated it.")
-        return redirect(url_for('.activity', id=id))
-
-    elif is_time_conflict():
-        flash("Pariticipation Failed!because you are not availiable at that time.")
-        return redirect(url_for('.activity', id=id))
-
-    else:
-        enrollment = Enrollment(activity_id=id, participant_id=current_user._get_current_object().id)
-        db.session.add(enrollment)
-        flash("Participate Succeed!")
-        return redirect(url_for('.activity', id=id))
+    if activity.disabled:
+        abort(404)
+    result = Enrollment.enroll(activity, current_user._get_current_object())
+    invalidate_page_cache(current_app)
+    flash(enrollment_result_to_str[result])
+    return redirect(url_for('.activity', id=id))
 
 
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_keyset(
+        Comment.query.options(joinedload(Comment.author)),
+        [Comment.timestamp.desc(), Comment.id.desc()],
+        per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+                           pagination=pagination)
 
 
 @main.route('/moderate/enable/<int:id>')
@@ -465,8 +436,9 @@ def moderate_enable(id):
     comment = Comment.query.get_or_404(id)
     comment.disabled = False
     db.session.add(comment)
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    invalidate_page_cache(current_app)
+    return redirect(url_for('.moderate', after=request.args.get('after'),
+                            before=request.args.get('before')))
 
 
 @main.route('/moderate/disable/<int:id>')
@@ -476,5 +448,6 @@ def moderate_disable(id):
     comment = Comment.query.get_or_404(id)
     comment.disabled = True
     db.session.add(comment)
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    invalidate_page_cache(current_app)
+    return redirect(url_for('.moderate', after=request.args.get('after'),
+                            before=request.args.get('before')))
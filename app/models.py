@@ -1,10 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from types import MappingProxyType
 import hashlib
-from werkzeug.security import generate_password_hash, check_password_hash
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import current_app, request
+from sqlalchemy import and_, exists, func, literal, select
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from flask import current_app, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
 from . import db, login_manager
+from .passwords import get_password_service
+from .tokens import get_token_service
 
 
 class Permission:
@@ -43,6 +48,57 @@ class Role(db.Model):
             role.default = roles[r][1]
             db.session.add(role)
         db.session.commit()
+        Role.invalidate_permission_map()
+
+    _permission_map = None
+    _role_ids = None
+
+    @staticmethod
+    def ensure_roles():
+        """Seed the roles table unless every role is already there."""
+        names = set(name for name, in db.session.query(Role.name))
+        if not names.issuperset(['User', 'Moderator', 'Administrator']):
+            Role.insert_roles()
+
+    @staticmethod
+    def _load():
+        permission_map, role_ids = {}, {}
+        for id, default, permissions in db.session.query(Role.id, Role.default, Role.permissions):
+            permission_map[id] = permissions
+            if default:
+                role_ids['default'] = id
+            if permissions == 0xff:
+                role_ids['administrator'] = id
+        Role._role_ids = MappingProxyType(role_ids)
+        Role._permission_map = MappingProxyType(permission_map)
+
+    @staticmethod
+    def permission_map():
+        """Read-only {role id: permissions} map, loaded once per process."""
+        if Role._permission_map is None:
+            Role._load()
+        return Role._permission_map
+
+    @staticmethod
+    def role_id(kind):
+        """Cached id of the 'default' or 'administrator' role, or None."""
+        if Role._role_ids is None:
+            Role._load()
+        return Role._role_ids.get(kind)
+
+    @staticmethod
+    def invalidate_permission_map():
+        Role._permission_map = None
+        Role._role_ids = None
+
+    @staticmethod
+    def permissions_of(role_id):
+        permissions = Role.permission_map().get(role_id)
+        if permissions is None:
+            # a role created since the map was loaded
+            Role.invalidate_permission_map()
+            permissions = Role.permission_map().get(role_id)
+        return permissions
 
     def __repr__(self):
         return '<Role %r>' % self.name
@@ -50,6 +106,10 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = 'follows'
+    # the primary key serves lookups by follower; this one serves followers
+    __table_args__ = (
+        db.Index('ix_follows_followed_follower', 'followed_id', 'follower_id'),
+    )
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
                             primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
@@ -87,72 +147,100 @@ class User(UserMixin, db.Model):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        Role.insert_roles()
-        if self.role is None:
-            if self.email == current_app.config['FLASKY_ADMIN']:
-                self.role = Role.query.filter_by(permissions=0xff).first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+        if self.role is None and self.role_id is None:
+            self.role_id = User.default_role_id(self.email)
         if self.email is not None and self.avatar_hash is None:
             self.avatar_hash = hashlib.md5(
                 self.email.encode('utf-8')).hexdigest()
 
+    @staticmethod
+    def default_role_id(email):
+        if Role.role_id('default') is None:
+            # no request has seeded the roles yet, e.g. manage.py generate_fake
+            Role.invalidate_permission_map()
+            Role.ensure_roles()
+        role_id = None
+        if email == current_app.config['FLASKY_ADMIN']:
+            role_id = Role.role_id('administrator')
+        return role_id or Role.role_id('default')
+
+    @staticmethod
+    def create_many(users):
+        """Insert the users described by the dicts in `users` with one
+        executemany per distinct set of keys and return how many were
+        inserted. Each dict takes the
+        User constructor's keywords; `password` is hashed unless a
+        `password_hash` is given."""
+        rows = []
+        for user in users:
+            row = dict(user)
+            if 'password' in row:
+                row['password_hash'] = get_password_service(current_app).hash(row.pop('password'))
+            if row.get('role_id') is None:
+                row['role_id'] = User.default_role_id(row.get('email'))
+            if row.get('email') is not None and row.get('avatar_hash') is None:
+                row['avatar_hash'] = hashlib.md5(row['email'].encode('utf-8')).hexdigest()
+            rows.append(row)
+        # executemany needs the same keys in every row, and missing keys
+        # must keep their column defaults, so group the rows by key set
+        groups = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        for group in groups.values():
+            db.session.execute(User.__table__.insert(), group)
+        db.session.commit()
+        return len(rows)
+
     @property
     def password(self):
         raise AttributeError('password is not a readable attribute')
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_service(current_app).hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Check `password`, re-hashing it if the stored hash was made with
+        other parameters than the configured ones."""
+        passwords = get_password_service(current_app)
+        if not passwords.verify(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.password_hash = passwords.hash(password)
+            db.session.add(self)
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'confirm': self.id})
+        return get_token_service(current_app).generate('confirm', {'confirm': self.id}, expiration)
 
     def confirm(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('confirm') != self.id:
+        result = get_token_service(current_app).verify('confirm', token)
+        if not result.valid or result.data.get('confirm') != self.id:
             return False
         self.confirmed = True
         db.session.add(self)
         return True
 
     def generate_reset_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'reset': self.id})
+        return get_token_service(current_app).generate('reset', {'reset': self.id}, expiration)
 
     def reset_password(self, token, new_password):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('reset') != self.id:
+        result = get_token_service(current_app).verify('reset', token)
+        if not result.valid or result.data.get('reset') != self.id:
             return False
         self.password = new_password
         db.session.add(self)
         return True
 
     def generate_email_change_token(self, new_email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'change_email': self.id, 'new_email': new_email})
+        return get_token_service(current_app).generate(
+            'change_email', {'change_email': self.id, 'new_email': new_email}, expiration)
 
     def change_email(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        result = get_token_service(current_app).verify('change_email', token)
+        if not result.valid or result.data.get('change_email') != self.id:
             return False
-        if data.get('change_email') != self.id:
-            return False
-        new_email = data.get('new_email')
+        new_email = result.data.get('new_email')
         if new_email is None:
             return False
         if self.query.filter_by(email=new_email).first() is not None:
@@ -164,25 +252,47 @@ class User(UserMixin, db.Model):
         return True
 
     def can(self, permissions):
-        return self.role is not None and \
-               (self.role.permissions & permissions) == permissions
+        if self.role_id is not None:
+            role_permissions = Role.permissions_of(self.role_id)
+        elif self.role is not None:
+            # not flushed yet
+            role_permissions = self.role.permissions
+        else:
+            return False
+        return role_permissions is not None and \
+            (role_permissions & permissions) == permissions
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        """Update last_seen in memory; it is only written once it moved by
+        FLASKY_LAST_SEEN_GRANULARITY, through the last_seen buffer if any."""
+        now = datetime.utcnow()
+        granularity = timedelta(seconds=current_app.config['FLASKY_LAST_SEEN_GRANULARITY'])
+        moved = self.last_seen is None or now - self.last_seen >= granularity
+        buffer = current_app.extensions.get('last_seen_buffer')
+        if moved and (buffer is None or self.id is None):
+            self.last_seen = now
+            db.session.add(self)
+            return
+        set_committed_value(self, 'last_seen', now)
+        if moved:
+            buffer.record(self.id, now)
 
     def gravatar(self, size=100, default='identicon', rating='g'):
-        if request.is_secure:
-            url = 'https://secure.gravatar.com/avatar'
-        else:
-            url = 'http://www.gravatar.com/avatar'
         hash = self.avatar_hash or hashlib.md5(
             self.email.encode('utf-8')).hexdigest()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-            url=url, hash=hash, size=size, default=default, rating=rating)
+        return _gravatar_url(hash, size, default, rating, request.is_secure)
+
+    def avatar_url(self, size=100):
+        """URL of the avatar as served by this app's /avatar proxy, or the
+        Gravatar URL when the proxy is disabled."""
+        if not current_app.config['FLASKY_AVATAR_PROXY']:
+            return self.gravatar(size=size)
+        hash = self.avatar_hash or hashlib.md5(
+            self.email.encode('utf-8')).hexdigest()
+        return url_for('main.avatar', hash=hash, size=size)
 
     @staticmethod
     def generate_fake(count=100):
@@ -224,15 +334,36 @@ class User(UserMixin, db.Model):
         return self.followers.filter_by(
             follower_id=user.id).first() is not None
 
+    def profile_counts(self):
+        """Published activities, followers and followed users in one query."""
+        follows = Follow.__table__
+        return db.session.execute(select([
+            select([func.count(Activity.id)]).
+                where(and_(Activity.publisher_id == self.id,
+                           Activity.disabled.isnot(True))).as_scalar().label('activities'),
+            select([func.count()]).select_from(follows).
+                where(follows.c.followed_id == self.id).as_scalar().label('followers'),
+            select([func.count()]).select_from(follows).
+                where(follows.c.follower_id == self.id).as_scalar().label('followed')])).first()
+
     @property
     def followed_activities(self):
-        return Activity.query.join(Follow, Follow.followed_id == Activity.publisher_id) \
-            .filter(Follow.follower_id == self.id)
+        return ActivityQuery().followed_by(self).query()
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+@lru_cache(maxsize=4096)
+def _gravatar_url(hash, size, default, rating, secure):
+    if secure:
+        url = 'https://secure.gravatar.com/avatar'
+    else:
+        url = 'http://www.gravatar.com/avatar'
+    return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+        url=url, hash=hash, size=size, default=default, rating=rating)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
         return False
@@ -246,7 +377,7 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return User.query.options(joinedload(User.role)).get(int(user_id))
 
 
 class ActivityStatus:
@@ -257,6 +388,14 @@ class ActivityStatus:
 
 class Activity(db.Model):
     __tablename__ = "activities"
+    __table_args__ = (
+        db.Index('ix_activities_location_begin_end',
+                 'location', 'begin_timestamp', 'end_timestamp'),
+        db.Index('ix_activities_publisher_publish', 'publisher_id', 'publish_timestamp'),
+    )
+    # publish/edit reject anything lasting a day or longer, which bounds how
+    # far back a conflicting activity can begin
+    MAX_DURATION = timedelta(days=1)
     id = db.Column(db.Integer, primary_key=True)
     publisher_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     publish_timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
@@ -267,29 +406,154 @@ class Activity(db.Model):
     description = db.Column(db.Text)
     capacity = db.Column(db.Integer)
     disabled = db.Column(db.Boolean, default=False)
+    enrolled_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # maintained by refresh_status() on write and advance_statuses() as time passes
+    status = db.Column(db.Integer, index=True, default=ActivityStatus.RESERVED,
+                       server_default=str(ActivityStatus.RESERVED), nullable=False)
     enrollments = db.relationship('Enrollment', backref='activity', lazy='dynamic')
     comments = db.relationship('Comment', backref='activity', lazy='dynamic')
 
-    def _get_status(self):
-        if datetime.now().__lt__(self.begin_timestamp):
+    @staticmethod
+    def venue_conflict_query(location, begin_timestamp, end_timestamp, exclude_id=None):
+        """Activities at `location` overlapping [begin_timestamp,
+        end_timestamp], earliest first.
+
+        Only rows whose begin falls inside (begin - MAX_DURATION, end] can
+        overlap, so this is a bounded range scan on the composite
+        (location, begin_timestamp, end_timestamp) index instead of a walk
+        over the venue's whole history.
+        """
+        query = Activity.query.filter(
+            Activity.location == location,
+            Activity.begin_timestamp > begin_timestamp - Activity.MAX_DURATION,
+            Activity.begin_timestamp <= end_timestamp,
+            Activity.end_timestamp >= begin_timestamp,
+            Activity.disabled.isnot(True))
+        if exclude_id is not None:
+            query = query.filter(Activity.id != exclude_id)
+        return query.order_by(Activity.begin_timestamp)
+
+    @staticmethod
+    def find_venue_conflict(location, begin_timestamp, end_timestamp, exclude_id=None):
+        """Return the earliest activity at `location` overlapping
+        [begin_timestamp, end_timestamp], or None."""
+        return Activity.venue_conflict_query(location, begin_timestamp, end_timestamp,
+                                             exclude_id).first()
+
+    def _get_status(self, now=None):
+        if now is None:
+            now = datetime.now()
+        if now.__lt__(self.begin_timestamp):
             return ActivityStatus.RESERVED
-        elif datetime.now().__lt__(self.end_timestamp):
+        elif now.__lt__(self.end_timestamp):
             return ActivityStatus.ONGOING
         else:
             return ActivityStatus.FINISHED
 
+    def refresh_status(self):
+        self.status = self._get_status()
+
     def _status2html(self):
-        if self._get_status() == ActivityStatus.RESERVED:
+        if self.status == ActivityStatus.RESERVED:
             capacity_num = self.capacity
-            participant_num = Enrollment.query.filter_by(activity_id=self.id).count()
+            participant_num = self.enrolled_count
             return "<font color=\"green\">Reserved(" + str(participant_num) + "/" + str(capacity_num) + ")</font>"
-        elif self._get_status() == ActivityStatus.ONGOING:
+        elif self.status == ActivityStatus.ONGOING:
             return "<font color=\"red\">Ongoing</font>"
-        elif self._get_status() == ActivityStatus.FINISHED:
+        elif self.status == ActivityStatus.FINISHED:
             return "<font color=\"black\">Finished</font>"
         else:
             raise ValueError("[Error]:activity status is error!")
 
+    @staticmethod
+    def advance_statuses(now=None):
+        """Move every activity whose transition time has passed to its
+        current status with two set-based UPDATEs; returns the number of
+        rows changed."""
+        if now is None:
+            now = datetime.now()
+        activities = Activity.__table__
+        changed = db.session.execute(
+            activities.update().
+            where(and_(activities.c.status != ActivityStatus.FINISHED,
+                       activities.c.end_timestamp <= now)).
+            values(status=ActivityStatus.FINISHED)).rowcount
+        changed += db.session.execute(
+            activities.update().
+            where(and_(activities.c.status == ActivityStatus.RESERVED,
+                       activities.c.begin_timestamp <= now)).
+            values(status=ActivityStatus.ONGOING)).rowcount
+        db.session.commit()
+        return changed
+
+    @staticmethod
+    def next_status_change():
+        """The earliest upcoming begin or end time at which some activity
+        changes status, or None."""
+        times = db.session.query(
+            db.session.query(func.min(Activity.begin_timestamp)).
+                filter(Activity.status == ActivityStatus.RESERVED).as_scalar(),
+            db.session.query(func.min(Activity.end_timestamp)).
+                filter(Activity.status == ActivityStatus.ONGOING).as_scalar()).one()
+        times = [t for t in times if t is not None]
+        return min(times) if times else None
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'location': self.location,
+            'publisher': self.publisher.username,
+            'publish_timestamp': self.publish_timestamp.isoformat(),
+            'begin_timestamp': self.begin_timestamp.isoformat(),
+            'end_timestamp': self.end_timestamp.isoformat(),
+            'capacity': self.capacity,
+            'enrolled_count': self.enrolled_count,
+            'comment_count': self.comment_count,
+        }
+
+    @staticmethod
+    def recount():
+        """Recompute enrolled_count and comment_count for every activity
+        with one correlated UPDATE."""
+        activities = Activity.__table__
+        enrollments = Enrollment.__table__
+        comments = Comment.__table__
+        db.session.execute(activities.update().values(
+            enrolled_count=select([func.count(enrollments.c.id)]).
+                where(enrollments.c.activity_id == activities.c.id).as_scalar(),
+            comment_count=select([func.count(comments.c.id)]).
+                where(comments.c.activity_id == activities.c.id).as_scalar()))
+        db.session.commit()
+
+    @staticmethod
+    def delete_many(ids, soft=False):
+        """Delete the activities in `ids` in one transaction; returns the
+        number of activities removed.
+
+        With `soft` they are only marked disabled, which hides them from
+        every listing but keeps their enrollments and comments. Otherwise
+        comments, enrollments and activities go with one DELETE each.
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+        activities = Activity.__table__
+        if soft:
+            deleted = db.session.execute(
+                activities.update().
+                where(and_(activities.c.id.in_(ids), activities.c.disabled.isnot(True))).
+                values(disabled=True)).rowcount
+        else:
+            for table in (Comment.__table__, Enrollment.__table__):
+                db.session.execute(table.delete().where(table.c.activity_id.in_(ids)))
+            deleted = db.session.execute(
+                activities.delete().where(activities.c.id.in_(ids))).rowcount
+        db.session.commit()
+        return deleted
+
     @staticmethod
     def generate_fake(count=100):
         from random import seed, randint, sample
@@ -303,24 +567,12 @@ class Activity(db.Model):
             while True:
                 begin_timestamp = datetime.now() + timedelta(days=randint(-100, 100)) + timedelta(hours=randint(0, 24))
                 end_timestamp = begin_timestamp + timedelta(hours=randint(1, 10))
-                location = forgery_py.address.city(),
-                if begin_timestamp.__ge__(end_timestamp):
-                    continue
+                location = forgery_py.address.city()
                 # 删除，用于构造Finsied的activity
                 # elif begin_timestamp.__lt__(datetime.now()):
                 #     continue
-                elif end_timestamp.__sub__(begin_timestamp).days >= 1:
+                if Activity.find_venue_conflict(location, begin_timestamp, end_timestamp) is not None:
                     continue
-
-                try:
-                    same_place_activities = Activity.query.filter_by(location=location).all()
-                except Exception:
-                    same_place_activities = Activity.query.filter_by(location=location[0]).all()
-
-                for same_place_activity in same_place_activities:
-                    if not (same_place_activity.begin_timestamp.__gt__(end_timestamp)
-                            or same_place_activity.end_timestamp.__lt__(begin_timestamp)):
-                        continue
                 break
 
             def generate_fake_name():
@@ -335,36 +587,242 @@ class Activity(db.Model):
                 return "关于" + selected_canteen[0] + "的" + selected_dishes[0] + "," + selected_canteen[1] + "的" + \
                        selected_dishes[1] + "那个更适合做" + selected_meal[0] + "的线下研讨会。"
 
-            try:
-                activity = Activity(publisher=publisher,
-                                    begin_timestamp=begin_timestamp,
-                                    end_timestamp=end_timestamp,
-                                    location=location,
-                                    name=generate_fake_name(),
-                                    description="到底那个更合适呢？快来讨论呀~",
-                                    capacity=randint(10, 100))
-                db.session.add(activity)
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-                activity = Activity(publisher=publisher,
-                                    begin_timestamp=begin_timestamp,
-                                    end_timestamp=end_timestamp,
-                                    location=location[0],
-                                    name=generate_fake_name(),
-                                    description="到底那个更合适呢？快来讨论呀~",
-                                    capacity=randint(10, 100))
-                db.session.add(activity)
-                db.session.commit()
+            activity = Activity(publisher=publisher,
+                                begin_timestamp=begin_timestamp,
+                                end_timestamp=end_timestamp,
+                                location=location,
+                                name=generate_fake_name(),
+                                description="到底那个更合适呢？快来讨论呀~",
+                                capacity=randint(10, 100))
+            db.session.add(activity)
+            db.session.commit()
+
+
+class ActivityQuery(object):
+    """Composable description of an activity listing.
+
+    Each method returns a new builder, so a base query can be shared and
+    refined. query() renders everything into one SELECT that filters on the
+    begin/end timestamp and location indexes and orders on a unique key,
+    which is what paginate_keyset() needs. The views, the JSON listing and
+    the CLI all go through this class.
+    """
+    ASC = 'asc'
+    DESC = 'desc'
+
+    def __init__(self, status=None, location=None, since=None, until=None,
+                 follower_id=None, joinable_by_id=None, begin_order=None, capacity_order=None):
+        self.status = status
+        self.location = location
+        self.since = since
+        self.until = until
+        self.follower_id = follower_id
+        self.joinable_by_id = joinable_by_id
+        self.begin_order = begin_order
+        self.capacity_order = capacity_order
+
+    def _replace(self, **changes):
+        state = dict(self.__dict__)
+        state.update(changes)
+        return ActivityQuery(**state)
+
+    def with_status(self, status):
+        """Restrict to an ActivityStatus; None means any status."""
+        return self._replace(status=status)
+
+    def at(self, location):
+        return self._replace(location=location or None)
+
+    def between(self, since=None, until=None):
+        """Only activities beginning in [since, until)."""
+        return self._replace(since=since, until=until)
+
+    def followed_by(self, user):
+        return self._replace(follower_id=user.id if user is not None else None)
+
+    def joinable_by(self, user):
+        """Only reserved activities with free seats that `user` did not
+        publish, has not joined and has time for."""
+        return self._replace(joinable_by_id=user.id if user is not None else None)
+
+    def order_by_begin(self, direction):
+        return self._replace(begin_order=direction)
+
+    def order_by_capacity(self, direction):
+        return self._replace(capacity_order=direction)
+
+    def order_by(self):
+        """ORDER BY clauses, always ending in the primary key."""
+        order_by = []
+        for column, direction in ((Activity.begin_timestamp, self.begin_order),
+                                  (Activity.capacity, self.capacity_order)):
+            if direction == ActivityQuery.ASC:
+                order_by.append(column.asc())
+            elif direction == ActivityQuery.DESC:
+                order_by.append(column.desc())
+            elif direction is not None:
+                raise ValueError("[Error]:unknown order direction %r" % direction)
+        if order_by:
+            return order_by + [Activity.id.asc()]
+        return [Activity.publish_timestamp.desc(), Activity.id.desc()]
+
+    def query(self):
+        """The filtered query, without ordering or eager loads applied."""
+        query = Activity.query.filter(Activity.disabled.isnot(True))
+        if self.follower_id is not None:
+            query = query.join(Follow, Follow.followed_id == Activity.publisher_id). \
+                filter(Follow.follower_id == self.follower_id)
+        if self.status is not None:
+            query = query.filter(Activity.status == self.status)
+        if self.joinable_by_id is not None:
+            enrollments = Enrollment.__table__
+            query = query.filter(
+                Activity.status == ActivityStatus.RESERVED,
+                Activity.publisher_id != self.joinable_by_id,
+                Activity.enrolled_count < Activity.capacity,
+                ~exists().where(and_(enrollments.c.activity_id == Activity.id,
+                                     enrollments.c.participant_id == self.joinable_by_id)),
+                ~Enrollment._time_conflict_clause(self.joinable_by_id, Activity.begin_timestamp,
+                                                  Activity.end_timestamp))
+        if self.location is not None:
+            query = query.filter(Activity.location == self.location)
+        if self.since is not None:
+            query = query.filter(Activity.begin_timestamp >= self.since)
+        if self.until is not None:
+            query = query.filter(Activity.begin_timestamp < self.until)
+        return query
+
+    def ordered(self):
+        """The complete statement: filters, ordering and the publisher join."""
+        return self.query().options(joinedload(Activity.publisher)).order_by(*self.order_by())
+
+
+class EnrollmentResult:
+    SUCCEED = 0x00
+    ONGOING = 0x01
+    FINISHED = 0x02
+    PUBLISHER = 0x03
+    FULL = 0x04
+    DUPLICATE = 0x05
+    TIME_CONFLICT = 0x06
 
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollment'
+    # one seat per participant; the second index serves time-conflict checks
+    __table_args__ = (
+        db.Index('ix_enrollment_activity_participant', 'activity_id', 'participant_id', unique=True),
+        db.Index('ix_enrollment_participant_activity', 'participant_id', 'activity_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow())
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     activity_id = db.Column(db.Integer, db.ForeignKey('activities.id'))
     participant_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 
+    @staticmethod
+    def _time_conflict_clause(participant_id, begin_timestamp, end_timestamp):
+        """EXISTS for an enrollment of `participant_id` in an activity
+        overlapping [begin_timestamp, end_timestamp].
+
+        The bounds may be values or columns of an enclosing activities query.
+        The participant's enrollments are found through the
+        (participant_id, activity_id) index and each joined activity by its
+        primary key, so the cost grows with that participant's schedule
+        only."""
+        enrollments = Enrollment.__table__
+        joined = Activity.__table__.alias('joined')
+        return exists().where(and_(enrollments.c.participant_id == participant_id,
+                                   joined.c.id == enrollments.c.activity_id,
+                                   joined.c.disabled.isnot(True),
+                                   joined.c.begin_timestamp <= end_timestamp,
+                                   joined.c.end_timestamp >= begin_timestamp))
+
+    @staticmethod
+    def participant_query(activity_id):
+        """(Enrollment, User) rows of `activity_id`, in sign-up order."""
+        return Enrollment.query.filter_by(activity_id=activity_id). \
+            join(User, User.id == Enrollment.participant_id).add_entity(User). \
+            order_by(Enrollment.timestamp.asc())
+
+    @staticmethod
+    def has_time_conflict(participant_id, begin_timestamp, end_timestamp):
+        return db.session.query(Enrollment._time_conflict_clause(
+            participant_id, begin_timestamp, end_timestamp)).scalar()
+
+    @staticmethod
+    def time_conflicts(participant_id, activity_ids):
+        """The subset of `activity_ids` overlapping something
+        `participant_id` has joined, checked in one query."""
+        activity_ids = list(activity_ids)
+        if not activity_ids:
+            return set()
+        activities = Activity.__table__
+        rows = db.session.execute(select([activities.c.id]).where(and_(
+            activities.c.id.in_(activity_ids),
+            Enrollment._time_conflict_clause(participant_id, activities.c.begin_timestamp,
+                                             activities.c.end_timestamp))))
+        return set(id for id, in rows)
+
+    @staticmethod
+    def enroll(activity, participant, timestamp=None):
+        """Enroll `participant` into `activity` and return an EnrollmentResult.
+
+        A seat is claimed with a guarded increment of enrolled_count, which
+        also row-locks the activity, and the participant's row is locked
+        next; the enrollment itself is a single INSERT ... SELECT ... WHERE
+        that rejects duplicates and overlapping enrollments, and gives the
+        seat back if it inserts nothing. Concurrent sign-ups can therefore
+        neither oversubscribe nor double-enroll nor double-book. The caller
+        owns the transaction and commits it.
+        """
+        status = activity._get_status()
+        if status == ActivityStatus.ONGOING:
+            return EnrollmentResult.ONGOING
+        elif status == ActivityStatus.FINISHED:
+            return EnrollmentResult.FINISHED
+        elif participant.id == activity.publisher_id:
+            return EnrollmentResult.PUBLISHER
+        return Enrollment._claim(activity, participant, timestamp)
+
+    @staticmethod
+    def _claim(activity, participant, timestamp=None):
+        """The seat claim and guarded INSERT behind enroll(), without its
+        status and publisher checks."""
+        activities = Activity.__table__
+        enrollments = Enrollment.__table__
+        seat = activities.update().where(activities.c.id == activity.id)
+        claimed = db.session.execute(
+            seat.where(activities.c.enrolled_count < activities.c.capacity).
+            values(enrolled_count=activities.c.enrolled_count + 1)).rowcount
+        db.session.expire(activity, ['enrolled_count'])
+        if not claimed:
+            return EnrollmentResult.FULL
+        # the seat claim only locks this activity, so serialize the
+        # participant too: otherwise two sign-ups for different overlapping
+        # activities would both pass the conflict check on PostgreSQL.
+        # SQLite ignores FOR UPDATE, but the UPDATE above already holds its
+        # database-wide write lock
+        db.session.query(User.id).filter(User.id == participant.id).with_for_update().first()
+
+        duplicate = exists().where(and_(enrollments.c.activity_id == activity.id,
+                                        enrollments.c.participant_id == participant.id))
+        conflict = Enrollment._time_conflict_clause(participant.id, activity.begin_timestamp,
+                                                    activity.end_timestamp)
+        insert = enrollments.insert().from_select(
+            ['activity_id', 'participant_id', 'timestamp'],
+            select([literal(activity.id, db.Integer),
+                    literal(participant.id, db.Integer),
+                    literal(timestamp or datetime.utcnow(), db.DateTime)]).
+            where(and_(~duplicate, ~conflict)))
+        if db.session.execute(insert).rowcount == 1:
+            return EnrollmentResult.SUCCEED
+
+        db.session.execute(seat.values(enrolled_count=activities.c.enrolled_count - 1))
+        if db.session.execute(select([duplicate])).scalar():
+            return EnrollmentResult.DUPLICATE
+        else:
+            return EnrollmentResult.TIME_CONFLICT
+
     @staticmethod
     def generate_fake(count=1000):
         from random import seed, randint
@@ -372,51 +830,30 @@ class Enrollment(db.Model):
         seed()
         user_count = User.query.count()
         activity_count = Activity.query.count()
-
-        def is_time_conflict(participant):
-            activities_of_participant = Enrollment.query. \
-                filter_by(participant_id=participant.id).all()
-            for activity_of_participant in activities_of_participant:
-                if activity.end_timestamp.__lt__(activity_of_participant.activity.begin_timestamp) or \
-                        activity.begin_timestamp.__gt__(activity_of_participant.activity.end_timestamp):
-                    continue
-                else:
-                    return True
-            return False
-
         for i in range(count):
             while True:
                 participant = User.query.offset(randint(0, user_count - 1)).first()
                 activity = Activity.query.offset(randint(0, activity_count - 1)).first()
-                # 删除，用于构造finished的activity
-                # if activity._get_status() == ActivityStatus.ONGOING:
-                #     continue
-                # elif activity._get_status() == ActivityStatus.FINISHED:
-                #     continue
+                # finished activities are filled too, so there is something to comment on
                 if participant == activity.publisher:
                     continue
-                elif Enrollment.query.filter_by(activity_id=activity.id).count() >= activity.capacity:
-                    continue
-                elif Enrollment.query.filter_by(activity_id=activity.id). \
-                        filter_by(participant_id=participant.id).all().__len__():
-                    continue
-                elif is_time_conflict(participant=participant):
-                    continue
-                else:
-                    enrollment = Enrollment(activity_id=activity.id, participant_id=participant.id,
-                                            timestamp=activity.begin_timestamp + timedelta(hours=randint(-3, 0)))
-                    db.session.add(enrollment)
+                timestamp = activity.begin_timestamp + timedelta(hours=randint(-3, 0))
+                if Enrollment._claim(activity, participant, timestamp) == EnrollmentResult.SUCCEED:
                     break
+        db.session.commit()
 
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_activity_timestamp', 'activity_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     activity_id = db.Column(db.Integer, db.ForeignKey('activities.id'))
 
     @staticmethod
@@ -435,3 +872,60 @@ class Comment(db.Model):
                                   author=enrollment_record.paticipant)
                 db.session.add(comment)
                 db.session.commit()
+
+
+class OutboxMessage(db.Model):
+    """An email waiting to be delivered by the MailOutbox workers.
+
+    Rows are claimed by setting `lease` and pushing next_attempt past the
+    lease time, deleted once sent, and given up on (next_attempt NULL)
+    after FLASKY_MAIL_MAX_ATTEMPTS failures."""
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(128))
+    recipients = db.Column(db.Text)
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    lease = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+
+    def to_message(self):
+        from flask_mail import Message
+        return Message(self.subject, sender=self.sender, recipients=self.recipients.split('\n'),
+                       body=self.body, html=self.html)
+
+
+def _counter_listener(column, delta):
+    def listener(mapper, connection, target):
+        activities = Activity.__table__
+        connection.execute(activities.update().
+                           where(activities.c.id == target.activity_id).
+                           values({column: activities.c[column] + delta}))
+    return listener
+
+
+def _refresh_activity_status(mapper, connection, target):
+    target.refresh_status()
+
+
+def _invalidate_permission_map(mapper, connection, target):
+    Role.invalidate_permission_map()
+
+
+db.event.listen(Activity, 'before_insert', _refresh_activity_status)
+db.event.listen(Activity, 'before_update', _refresh_activity_status)
+
+# keep the Activity counters in step with rows written through the ORM;
+# Enrollment.enroll() maintains enrolled_count itself
+db.event.listen(Enrollment, 'after_insert', _counter_listener('enrolled_count', 1))
+db.event.listen(Enrollment, 'after_delete', _counter_listener('enrolled_count', -1))
+db.event.listen(Comment, 'after_insert', _counter_listener('comment_count', 1))
+db.event.listen(Comment, 'after_delete', _counter_listener('comment_count', -1))
+
+db.event.listen(Role, 'after_insert', _invalidate_permission_map)
+db.event.listen(Role, 'after_update', _invalidate_permission_map)
+db.event.listen(Role, 'after_delete', _invalidate_permission_map)
@@ -0,0 +1,134 @@
+import base64
+import json
+from datetime import datetime
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+
+class KeysetPagination(object):
+    """Cursor-based counterpart of flask_sqlalchemy's Pagination.
+
+    Pages are addressed by opaque `after`/`before` cursors that encode the
+    sort key of the boundary row, so every page is an index range scan no
+    matter how deep it is. `total` is only filled in when asked for."""
+    cursor_based = True
+
+    def __init__(self, items, has_prev, has_next, prev_cursor=None, next_cursor=None,
+                 total=None):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total = total
+
+
+def encode_cursor(values):
+    values = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    if not isinstance(values, list):
+        raise ValueError('malformed cursor')
+    return [_parse_datetime(v['dt']) if isinstance(v, dict) else v for v in values]
+
+
+def _parse_datetime(value):
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('malformed cursor')
+
+
+def cursor_matches(values, types):
+    """Whether decoded cursor `values` has one value of the matching
+    type, as for isinstance(), per sort column."""
+    return len(values) == len(types) and \
+        all(isinstance(value, kind) for value, kind in zip(values, types))
+
+
+def _cursor_type(column):
+    try:
+        kind = column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return object
+    if kind is float:
+        kind = (int, float)
+    if getattr(column, 'nullable', False):
+        kind = (kind if isinstance(kind, tuple) else (kind,)) + (type(None),)
+    return kind
+
+
+def _sort_keys(order_by):
+    keys = []
+    for clause in order_by:
+        if isinstance(clause, UnaryExpression) and clause.modifier is operators.desc_op:
+            keys.append((clause.element, True))
+        elif isinstance(clause, UnaryExpression) and clause.modifier is operators.asc_op:
+            keys.append((clause.element, False))
+        else:
+            keys.append((clause, False))
+    return keys
+
+
+def _seek(keys, values, backwards):
+    """Rows strictly after `values` in (backwards ? reversed : normal) order."""
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        if descending != backwards:
+            step = column < values[i]
+        else:
+            step = column > values[i]
+        clauses.append(and_(*[keys[j][0] == values[j] for j in range(i)] + [step]))
+    return or_(*clauses)
+
+
+def _order(keys, backwards):
+    return [column.desc() if descending != backwards else column.asc()
+            for column, descending in keys]
+
+
+def paginate_keyset(query, order_by, per_page, count=None):
+    """Page `query` by the columns in `order_by`, which must end in a unique
+    key. The cursor comes from the `after`/`before` request arguments; a
+    malformed cursor aborts with 400."""
+    keys = _sort_keys(order_by)
+    if count is None:
+        count = current_app.config.get('FLASKY_PAGINATION_COUNT', False)
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = before or after
+    backwards = before is not None
+    page_query = query
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+        except (ValueError, TypeError, KeyError):
+            abort(400)
+        if not cursor_matches(values, [_cursor_type(column) for column, descending in keys]):
+            abort(400)
+        page_query = page_query.filter(_seek(keys, values, backwards))
+    rows = page_query.order_by(*_order(keys, backwards)).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+
+    def key_of(item):
+        return [getattr(item, column.key) for column, descending in keys]
+
+    return KeysetPagination(
+        items, has_prev, has_next,
+        prev_cursor=encode_cursor(key_of(items[0])) if has_prev and items else None,
+        next_cursor=encode_cursor(key_of(items[-1])) if has_next and items else None,
+        total=query.order_by(None).count() if count else None)
@@ -0,0 +1,50 @@
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordService(object):
+    """Hashes and checks passwords with the configured werkzeug method.
+
+    `method` carries the cost, e.g. 'pbkdf2:sha256:150000'. Hashes made with
+    anything else report needs_rehash(), which User.verify_password() uses
+    to upgrade them on the next successful login. With `workers` > 0 the
+    hashing runs in a process pool of that size, so a burst of logins can
+    use at most that many cores and leaves the rest to other requests."""
+
+    def __init__(self, method='pbkdf2:sha256:150000', salt_length=8, workers=0):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # created on first use, i.e. after the server forked
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor.submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def get_password_service(app):
+    return app.extensions['passwords']
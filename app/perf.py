@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+from collections import Counter, deque
+from flask import current_app, g, has_request_context, request, before_render_template, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# a statement run this often within one request is most likely an N+1
+REPEATED_STATEMENT = 3
+
+
+def percentile(values, fraction):
+    """The value below which `fraction` of the sorted `values` fall."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class RequestStats(object):
+    __slots__ = ('start', 'sampled', 'queries', 'db_time', 'statements',
+                 'render_time', 'render_start')
+
+    def __init__(self, sampled):
+        self.start = time.perf_counter()
+        self.sampled = sampled
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter() if sampled else None
+        self.render_time = 0.0
+        self.render_start = None
+
+
+class RequestProfiler(object):
+    """Per-request query count, database time, repeated statements and
+    template render time.
+
+    Statements are timed through engine events, so this works without
+    SQLALCHEMY_RECORD_QUERIES. Every request is checked for slow queries;
+    only the FLASKY_PERF_SAMPLE_RATE fraction is profiled in full, kept in
+    a ring buffer of the latest FLASKY_PERF_BUFFER_SIZE requests and
+    reported in a Server-Timing header."""
+
+    def __init__(self, app):
+        self.sample_rate = app.config['FLASKY_PERF_SAMPLE_RATE']
+        self.server_timing = app.config['FLASKY_PERF_SERVER_TIMING']
+        self.slow_query_time = app.config['FLASKY_SLOW_DB_QUERY_TIME']
+        self.records = deque(maxlen=app.config['FLASKY_PERF_BUFFER_SIZE'])
+        _listen_to_engines()
+        # ahead of the blueprints' hooks, so loading the user is measured too
+        app.before_request_funcs.setdefault(None, []).insert(0, self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    def _before_request(self):
+        g.perf = RequestStats(random.random() < self.sample_rate)
+
+    def _before_render(self, app, template, context):
+        stats = getattr(g, 'perf', None)
+        if stats is not None:
+            stats.render_start = time.perf_counter()
+
+    def _after_render(self, app, template, context):
+        stats = getattr(g, 'perf', None)
+        if stats is not None and stats.render_start is not None:
+            stats.render_time += time.perf_counter() - stats.render_start
+            stats.render_start = None
+
+    def _after_request(self, response):
+        stats = getattr(g, 'perf', None)
+        if stats is None or not stats.sampled:
+            return response
+        total = time.perf_counter() - stats.start
+        statement, count = (stats.statements.most_common(1) or [(None, 0)])[0]
+        record = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'status': response.status_code,
+            'timestamp': time.time(),
+            'total_ms': total * 1000,
+            'db_ms': stats.db_time * 1000,
+            'render_ms': stats.render_time * 1000,
+            'queries': stats.queries,
+            'duplicates': stats.queries - len(stats.statements),
+            'repeated': [statement[:300], count] if count >= REPEATED_STATEMENT else None,
+        }
+        self.records.append(record)
+        if self.server_timing:
+            response.headers.add('Server-Timing', 'db;dur=%.1f;desc="%d queries", render;dur=%.1f, '
+                                 'total;dur=%.1f' % (record['db_ms'], stats.queries,
+                                                     record['render_ms'], record['total_ms']))
+        return response
+
+    def _teardown_request(self, exc):
+        g.pop('perf', None)
+
+    def summary(self, recent=20):
+        """Aggregates per endpoint over the buffered requests, slowest
+        first, plus the `recent` latest records."""
+        records = list(self.records)
+        by_endpoint = {}
+        for record in records:
+            by_endpoint.setdefault(record['endpoint'], []).append(record)
+        endpoints = []
+        for endpoint, rows in by_endpoint.items():
+            totals = sorted(row['total_ms'] for row in rows)
+            repeated = [row['repeated'] for row in rows if row['repeated']]
+            endpoints.append({
+                'endpoint': endpoint,
+                'requests': len(rows),
+                'p50_ms': percentile(totals, 0.50),
+                'p95_ms': percentile(totals, 0.95),
+                'max_ms': totals[-1],
+                'db_ms': sum(row['db_ms'] for row in rows) / len(rows),
+                'render_ms': sum(row['render_ms'] for row in rows) / len(rows),
+                'queries': sum(row['queries'] for row in rows) / len(rows),
+                'max_queries': max(row['queries'] for row in rows),
+                'duplicates': sum(row['duplicates'] for row in rows) / len(rows),
+                'repeated': max(repeated, key=lambda item: item[1]) if repeated else None,
+            })
+        endpoints.sort(key=lambda item: item['p95_ms'], reverse=True)
+        return {'sample_rate': self.sample_rate, 'buffered': len(records),
+                'endpoints': endpoints, 'recent': records[-recent:] if recent else []}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._perf_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_perf_start', None)
+    if start is None or not has_request_context():
+        return
+    stats = getattr(g, 'perf', None)
+    if stats is None:
+        return
+    duration = time.perf_counter() - start
+    stats.queries += 1
+    stats.db_time += duration
+    if stats.statements is not None:
+        stats.statements[statement] += 1
+    profiler = current_app.extensions.get('perf')
+    if profiler is not None and duration >= profiler.slow_query_time:
+        current_app.logger.warning(
+            'Slow query: %s\nParameters: %s\nDuration: %fs\nEndpoint: %s\n'
+            % (statement, parameters, duration, request.endpoint))
+
+
+_listening = False
+_listen_lock = threading.Lock()
+
+
+def _listen_to_engines():
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _listening = True
+
+
+def get_profiler(app):
+    return app.extensions.get('perf')
@@ -0,0 +1,88 @@
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import Follow, Activity, ActivityQuery, Enrollment, Comment
+
+# SQLite reports a full pass over a table or one of its indexes as SCAN,
+# a lookup as SEARCH
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX \w+)?$')
+POSTGRESQL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def main_queries(id=1, now=None):
+    """(name, statement, walked) for the queries behind the busiest pages,
+    bound to a sample user/activity `id`. `walked` names the tables a query
+    may read in index order instead of searching, as unfiltered listings do."""
+    now = now or datetime.now()
+    return [
+        ('index', ActivityQuery().ordered().limit(20), ('activities',)),
+        ('followed activities', ActivityQuery(follower_id=id).ordered().limit(20), ('activities',)),
+        ('joinable activities', ActivityQuery(joinable_by_id=id).ordered().limit(20), ('activities',)),
+        ('user activities', Activity.query.filter(Activity.publisher_id == id).
+            order_by(Activity.publish_timestamp.desc(), Activity.id.desc()).limit(20), ()),
+        ('venue conflict', Activity.venue_conflict_query(
+            'hall', now, now + timedelta(hours=2), exclude_id=id).limit(1), ()),
+        ('participants', Enrollment.participant_query(id).limit(20), ()),
+        ('duplicate enrollment', Enrollment.query.filter_by(activity_id=id, participant_id=id), ()),
+        ('time conflict', select([Enrollment._time_conflict_clause(id, now, now)]), ()),
+        ('activity comments', Comment.query.filter_by(activity_id=id).
+            options(joinedload(Comment.author)).order_by(Comment.timestamp.asc()).limit(20), ()),
+        ('author comments', Comment.query.filter_by(author_id=id), ()),
+        ('followers', Follow.query.filter_by(followed_id=id).
+            order_by(Follow.timestamp.desc(), Follow.follower_id.desc()).limit(20), ()),
+        ('followed', Follow.query.filter_by(follower_id=id).
+            order_by(Follow.timestamp.desc(), Follow.followed_id.desc()).limit(20), ()),
+    ]
+
+
+def explain(statement):
+    """The plan of `statement` as a list of lines, or None if this database
+    is not supported."""
+    if hasattr(statement, 'with_labels'):
+        statement = statement.with_labels().statement
+    dialect = db.engine.dialect
+    compiled = statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    connection = db.session.connection()
+    if dialect.name == 'sqlite':
+        rows = connection.execute('EXPLAIN QUERY PLAN ' + compiled.string, params)
+        return [row[-1] for row in rows]
+    elif dialect.name == 'postgresql':
+        # with sequential scans priced out, any that remain have no index
+        # to fall back on, whatever the size of the tables
+        connection.execute('SET LOCAL enable_seqscan = off')
+        try:
+            return [row[0] for row in connection.execute('EXPLAIN ' + compiled.string, params)]
+        finally:
+            connection.execute('SET LOCAL enable_seqscan = on')
+    return None
+
+
+def sequential_scans(plan):
+    """Tables `plan` reads without an index."""
+    pattern = SQLITE_SCAN if db.engine.dialect.name == 'sqlite' else POSTGRESQL_SCAN
+    tables = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) not in tables:
+            tables.append(match.group(1))
+    return tables
+
+
+def check_plans(id=1):
+    """Explain every main query; returns [(name, plan, scanned tables)], or
+    None if this database cannot be checked."""
+    reports = []
+    for name, statement, walked in main_queries(id):
+        plan = explain(statement)
+        if plan is None:
+            return None
+        reports.append((name, plan, [table for table in sequential_scans(plan)
+                                     if table not in walked]))
+    db.session.rollback()
+    return reports
@@ -0,0 +1,59 @@
+import threading
+from datetime import datetime
+from . import db
+
+
+class StatusScheduler(object):
+    """Background thread that moves Activity.status from RESERVED to ONGOING
+    to FINISHED.
+
+    It sleeps until the next begin/end time known to the database and wakes
+    up early when this process publishes or edits an activity. The sleep is
+    capped at FLASKY_STATUS_POLL_INTERVAL so activities written by other
+    processes are picked up too."""
+
+    def __init__(self, app):
+        self.app = app
+        self.poll_interval = app.config['FLASKY_STATUS_POLL_INTERVAL']
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='status-scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def tick(self):
+        """Apply due transitions and return seconds until the next one."""
+        from .models import Activity
+
+        with self.app.app_context():
+            try:
+                Activity.advance_statuses()
+                upcoming = Activity.next_status_change()
+            finally:
+                db.session.remove()
+        if upcoming is None:
+            return self.poll_interval
+        delay = (upcoming - datetime.now()).total_seconds()
+        return min(max(delay, 0), self.poll_interval)
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.tick()
+            except Exception:
+                self.app.logger.exception('Activity status scheduler failed')
+                delay = self.poll_interval
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+
+def wake_status_scheduler(app):
+    scheduler = app.extensions.get('status_scheduler')
+    if scheduler is not None:
+        scheduler.wake()
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import abort, request
+from sqlalchemy.orm import joinedload
+from .pagination import KeysetPagination, encode_cursor, decode_cursor, cursor_matches
+
+
+class LocalTimelineStore(object):
+    """In-process stand-in for a shared timeline store.
+
+    Keeps, for the most recently used `max_users` followers, a list of
+    (publish_timestamp, activity_id) entries newest first, at most `length`
+    long. Lists older than `ttl` seconds are dropped, which bounds how stale
+    a worker can get when another process did the fan-out."""
+
+    def __init__(self, max_users=10000, length=500, ttl=300):
+        self.max_users = max_users
+        self.length = length
+        self.ttl = ttl
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._lists.get(user_id)
+            if item is None:
+                return None
+            built, entries = item
+            if time.time() - built > self.ttl:
+                del self._lists[user_id]
+                return None
+            self._lists.move_to_end(user_id)
+            return list(entries)
+
+    def set(self, user_id, entries):
+        with self._lock:
+            self._lists[user_id] = (time.time(), list(entries[:self.length]))
+            self._lists.move_to_end(user_id)
+            while len(self._lists) > self.max_users:
+                self._lists.popitem(last=False)
+
+    def push(self, user_ids, entry):
+        """Add `entry` to the lists of those `user_ids` that are cached."""
+        with self._lock:
+            for user_id in user_ids:
+                item = self._lists.get(user_id)
+                if item is None:
+                    continue
+                entries = item[1]
+                entries.append(entry)
+                entries.sort(reverse=True)
+                del entries[self.length:]
+
+    def discard(self, user_id):
+        with self._lock:
+            self._lists.pop(user_id, None)
+
+
+class Timeline(object):
+    """Fan-out-on-write home timeline for the "followed" activity tab.
+
+    publish pushes the new activity into every cached follower list; reads
+    page through the list and only fall back to the Follow/Activity join
+    when a list is missing (then back-filled) or a page runs past its end.
+    Pages use the same cursors as paginate_keyset() over
+    (publish_timestamp desc, id desc), so both paths are interchangeable."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _backfill(self, user_id):
+        from .models import Activity, ActivityQuery
+        query = ActivityQuery(follower_id=user_id).query(). \
+            with_entities(Activity.publish_timestamp, Activity.id). \
+            order_by(Activity.publish_timestamp.desc(), Activity.id.desc()). \
+            limit(self.store.length)
+        entries = [(publish_timestamp, id) for publish_timestamp, id in query]
+        self.store.set(user_id, entries)
+        return entries
+
+    def on_publish(self, activity):
+        from .models import Follow
+        follower_ids = [follower_id for follower_id, in
+                        Follow.query.with_entities(Follow.follower_id).
+                        filter_by(followed_id=activity.publisher_id)]
+        self.store.push(follower_ids, (activity.publish_timestamp, activity.id))
+
+    def on_follow_change(self, user):
+        self._backfill(user.id)
+
+    def paginate(self, user, per_page):
+        """A KeysetPagination of `user`'s followed activities for the
+        `after`/`before` cursor in the request, or None if the page runs past
+        the end of a full list, or starts beyond it, and has to come from the
+        database."""
+        from .models import Activity
+
+        after = request.args.get('after')
+        before = request.args.get('before')
+        try:
+            cursor = tuple(decode_cursor(before or after)) if before or after else None
+        except (ValueError, TypeError, KeyError):
+            abort(400)
+        # entries are (publish_timestamp, id) and are compared with the cursor
+        if cursor is not None and not cursor_matches(cursor, (datetime, int)):
+            abort(400)
+        entries = self.store.get(user.id)
+        if entries is None:
+            entries = self._backfill(user.id)
+        if before:
+            # a cursor older than the end of a full list was handed out by
+            # the database path, and the rows in between are not in the list
+            if len(entries) >= self.store.length and cursor < entries[-1]:
+                return None
+            newer = [entry for entry in entries if entry > cursor]
+            window = newer[-per_page:]
+            has_prev, has_next = len(newer) > per_page, True
+        else:
+            older = [entry for entry in entries if cursor is None or entry < cursor]
+            if len(older) <= per_page and len(entries) >= self.store.length:
+                return None
+            window = older[:per_page]
+            has_prev, has_next = cursor is not None, len(older) > per_page
+
+        ids = [id for publish_timestamp, id in window]
+        rows = Activity.query.options(joinedload(Activity.publisher)). \
+            filter(Activity.id.in_(ids), Activity.disabled.isnot(True)).all() if ids else []
+        by_id = dict((activity.id, activity) for activity in rows)
+        return KeysetPagination(
+            [by_id[id] for id in ids if id in by_id], has_prev, has_next,
+            prev_cursor=encode_cursor(list(window[0])) if has_prev and window else None,
+            next_cursor=encode_cursor(list(window[-1])) if has_next and window else None)
+
+
+def get_timeline(app):
+    return app.extensions.get('timeline')
+
+
+def fan_out_activity(app, activity):
+    timeline = get_timeline(app)
+    if timeline is not None:
+        timeline.on_publish(activity)
+
+
+def refresh_timeline(app, user):
+    timeline = get_timeline(app)
+    if timeline is not None:
+        timeline.on_follow_change(user)
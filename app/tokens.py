@@ -0,0 +1,62 @@
+from collections import namedtuple
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadData, SignatureExpired
+
+
+class TokenStatus:
+    VALID = 0
+    EXPIRED = 1
+    INVALID = 2
+
+
+class TokenResult(namedtuple('TokenResult', ['status', 'data'])):
+    """Outcome of verifying a token; `data` is the payload when VALID."""
+    __slots__ = ()
+
+    @property
+    def valid(self):
+        return self.status == TokenStatus.VALID
+
+
+class TokenService(object):
+    """Signs and checks the confirmation, reset and email change tokens.
+
+    Every purpose signs with its own salt, so a token issued for one
+    purpose is rejected for any other, and serializers are built once per
+    (purpose, expiry) instead of on every call."""
+    salt_prefix = 'wesalon.'
+    default_expiration = 3600
+
+    def __init__(self, secret_key):
+        self.secret_key = secret_key
+        self._serializers = {}
+
+    def _serializer(self, purpose, expiration):
+        key = (purpose, expiration)
+        serializer = self._serializers.get(key)
+        if serializer is None:
+            serializer = self._serializers[key] = Serializer(
+                self.secret_key, expiration, salt=self.salt_prefix + purpose)
+        return serializer
+
+    def generate(self, purpose, data, expiration=None):
+        serializer = self._serializer(purpose, expiration or self.default_expiration)
+        return serializer.dumps(data).decode('ascii')
+
+    def verify(self, purpose, token):
+        # expiry is read from the token itself, so any serializer for the
+        # purpose will do
+        serializer = self._serializer(purpose, self.default_expiration)
+        try:
+            return TokenResult(TokenStatus.VALID, serializer.loads(token))
+        except SignatureExpired:
+            return TokenResult(TokenStatus.EXPIRED, None)
+        except BadData:
+            return TokenResult(TokenStatus.INVALID, None)
+
+    def verify_many(self, purpose, tokens):
+        """Verify every token in `tokens`; returns a list of TokenResults."""
+        return [self.verify(purpose, token) for token in tokens]
+
+
+def get_token_service(app):
+    return app.extensions['tokens']
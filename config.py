@@ -18,13 +18,45 @@ class Config:
     assert MAIL_PASSWORD is not None
     FLASKY_MAIL_SUBJECT_PREFIX = 'WeSalon'
     FLASKY_MAIL_SENDER = 'yueht17@tom.com'
+    FLASKY_MAIL_OUTBOX = True
+    FLASKY_MAIL_WORKERS = 2
+    FLASKY_MAIL_BATCH_SIZE = 50
+    FLASKY_MAIL_MAX_ATTEMPTS = 8
+    FLASKY_MAIL_RETRY_DELAY = 30
+    FLASKY_MAIL_POLL_INTERVAL = 30
+    FLASKY_MAIL_LEASE_TIME = 600
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
     assert FLASKY_ADMIN is not None
     FLASKY_ACTIVITIES_PER_PAGE = 5
     FLASKY_FOLLOWERS_PER_PAGE = 50
     FLASKY_PARTICIPANTS_PER_PAGE = 50
     FLASKY_COMMENTS_PER_PAGE = 50
+    FLASKY_PAGINATION_COUNT = False
+    FLASKY_BOOTSTRAP_ROLES = True
+    FLASKY_STATUS_SCHEDULER = True
+    FLASKY_STATUS_POLL_INTERVAL = 60
+    FLASKY_TIMELINE_FANOUT = True
+    FLASKY_TIMELINE_USERS = 10000
+    FLASKY_TIMELINE_LENGTH = 500
+    FLASKY_TIMELINE_TTL = 300
+    FLASKY_LAST_SEEN_BUFFER = True
+    FLASKY_LAST_SEEN_GRANULARITY = 60
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10
+    FLASKY_AVATAR_PROXY = True
+    FLASKY_AVATAR_FETCH = True
+    FLASKY_AVATAR_CACHE_DIR = os.environ.get('FLASKY_AVATAR_CACHE_DIR')
+    FLASKY_AVATAR_CACHE_BYTES = 64 * 1024 * 1024
+    FLASKY_AVATAR_MAX_SIZE = 512
+    FLASKY_AVATAR_MAX_AGE = 7 * 24 * 60 * 60
+    FLASKY_PAGE_CACHE_SIZE = 512
+    FLASKY_ACTIVITY_SOFT_DELETE = False
+    FLASKY_PASSWORD_METHOD = os.environ.get('FLASKY_PASSWORD_METHOD') or 'pbkdf2:sha256:150000'
+    FLASKY_PASSWORD_WORKERS = int(os.environ.get('FLASKY_PASSWORD_WORKERS') or 0)
     FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_PERF_PROFILER = True
+    FLASKY_PERF_SAMPLE_RATE = float(os.environ.get('FLASKY_PERF_SAMPLE_RATE') or 1.0)
+    FLASKY_PERF_BUFFER_SIZE = 1000
+    FLASKY_PERF_SERVER_TIMING = True
 
     @staticmethod
     def init_app(app):
@@ -39,6 +71,13 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    WTF_CSRF_ENABLED = False
+    FLASKY_BOOTSTRAP_ROLES = False
+    FLASKY_STATUS_SCHEDULER = False
+    FLASKY_LAST_SEEN_BUFFER = False
+    FLASKY_MAIL_OUTBOX = False
+    FLASKY_AVATAR_FETCH = False
+    FLASKY_PASSWORD_METHOD = 'pbkdf2:sha256:1000'
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
@@ -46,6 +85,10 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
+    # the profiler times queries itself; recording keeps every statement
+    SQLALCHEMY_RECORD_QUERIES = False
+    FLASKY_PERF_SAMPLE_RATE = float(os.environ.get('FLASKY_PERF_SAMPLE_RATE') or 0.05)
+    FLASKY_PERF_SERVER_TIMING = False
 
     @classmethod
     def init_app(cls, app):
@@ -49,7 +49,17 @@ def test(coverage=False):
 
 
 @manager.command
-def generate_fake():
+def generate_fake(bulk=None, random_seed=None):
+    """Generate fake data; --bulk SCALE uses the NumPy bulk generator
+    (scale 1 is about a million enrollments)."""
+    if bulk is not None:
+        from app.fake import generate_bulk
+        counts = generate_bulk(scale=float(bulk),
+                               seed=int(random_seed) if random_seed is not None else None)
+        for table in ('users', 'follows', 'activities', 'enrollments', 'comments'):
+            print("[Info]:%d %s" % (counts[table], table))
+        print("[Info]:Generate fake info Done!")
+        return
     User.generate_fake()
     Activity.generate_fake()
     Enrollment.generate_fake()
@@ -57,6 +67,69 @@ def generate_fake():
     print("[Info]:Generate fake info Done!")
 
 
+@manager.command
+def list_activities(status=None, location=None, order=None, count=20):
+    """List activities, e.g. --status reserved --location Beijing --order asc."""
+    from app.models import ActivityQuery, ActivityStatus
+    statuses = {'reserved': ActivityStatus.RESERVED,
+                'ongoing': ActivityStatus.ONGOING,
+                'finished': ActivityStatus.FINISHED}
+    activity_query = ActivityQuery(status=statuses[status] if status else None,
+                                   location=location, begin_order=order)
+    for activity in activity_query.ordered().limit(count):
+        print("[%d] %s @ %s, %s ~ %s, %d/%d enrolled" % (
+            activity.id, activity.name, activity.location,
+            activity.begin_timestamp.__format__("%Y-%m-%d %H:%M"),
+            activity.end_timestamp.__format__("%Y-%m-%d %H:%M"),
+            activity.enrolled_count, activity.capacity))
+
+
+@manager.command
+def recount():
+    """Recompute the denormalized activity counters."""
+    Activity.recount()
+    print("[Info]:Recount activity counters Done!")
+
+
+@manager.command
+def delete_activities(ids='', finished_before=None, soft=False):
+    """Delete activities by id, e.g. --ids 3,4,5, or all finished before
+    a date, e.g. --finished_before 2017-01-01; --soft only disables them."""
+    from datetime import datetime
+    selected = [int(id) for id in ids.split(',') if id.strip()]
+    if finished_before:
+        until = datetime.strptime(finished_before, '%Y-%m-%d')
+        selected += [id for id, in db.session.query(Activity.id).
+                     filter(Activity.end_timestamp < until)]
+    print("[Info]:%d activities deleted" % Activity.delete_many(set(selected), soft=soft))
+
+
+@manager.command
+def refresh_status():
+    """Move activities whose begin or end time has passed to their current status."""
+    print("[Info]:%d activities changed status" % Activity.advance_statuses())
+
+
+@manager.command
+def check_plans():
+    """EXPLAIN the main queries and report any that scan a whole table."""
+    import sys
+    from app.plans import check_plans
+    reports = check_plans()
+    if reports is None:
+        print("[Error]:EXPLAIN checks support SQLite and PostgreSQL only")
+        sys.exit(2)
+    for name, plan, scans in reports:
+        print("[%s]:%s" % ("Warning" if scans else "Info", name))
+        for line in plan:
+            print("    " + line)
+    scanned = [name for name, plan, scans in reports if scans]
+    if scanned:
+        print("[Error]:sequential scans in %s" % ", ".join(scanned))
+        sys.exit(1)
+    print("[Info]:no sequential scans")
+
+
 @manager.command
 def profile(length=25, profile_dir=None):
     from werkzeug.contrib.profiler import ProfilerMiddleware
@@ -65,12 +138,103 @@ def profile(length=25, profile_dir=None):
     app.run()
 
 
+@manager.command
+def bench(scale=0.01, number=50, random_seed=1, output=None, baseline=None, tolerance=0.25,
+          database_url=None):
+    """Benchmark the main routes on a seeded dataset, e.g. --scale 0.01
+    --number 50 --output bench.json --baseline last.json; exits non-zero
+    on regressions against the baseline."""
+    import json
+    import sys
+    from app.benchmark import make_bench_app, bench_routes, compare_reports
+    with make_bench_app(database_url=database_url) as bench_app:
+        report = bench_routes(bench_app, scale=float(scale), requests=int(number),
+                              seed=int(random_seed))
+    for name, route in sorted(report['routes'].items(), key=lambda item: -item[1]['p95_ms']):
+        print("[Info]:%-18s p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  %5.1f queries  %7.1f req/s  %s" % (
+            name, route['p50_ms'], route['p95_ms'], route['p99_ms'], route['queries'],
+            route['throughput'], route['statuses']))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("[Info]:report written to %s" % output)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_reports(report, json.load(f), tolerance=float(tolerance))
+        for regression in regressions:
+            print("[Error]:regression in %s" % regression)
+        if regressions:
+            sys.exit(1)
+        print("[Info]:no regressions against %s" % baseline)
+
+
+@manager.command
+def bench_enroll(enrollers=200, capacity=0, activities=1, database_url=None):
+    """Benchmark concurrent sign-ups for one or more overlapping activities."""
+    from app.benchmark import make_bench_app, bench_enroll as run
+    with make_bench_app(database_url=database_url) as bench_app:
+        report = run(bench_app, concurrency=int(enrollers), capacity=int(capacity) or None,
+                     activities=int(activities))
+    print("[Info]:%(concurrency)d enrollers, %(activities)d activities of capacity %(capacity)d, "
+          "%(enrolled)d enrolled in %(elapsed).3fs (%(throughput).1f enrollments/s)" % report)
+    print("[Info]:outcomes %s" % report['outcomes'])
+    if report['oversubscribed']:
+        print("[Error]:activity was oversubscribed!")
+    if report['double_booked']:
+        print("[Error]:%(double_booked)d participants were double-booked!" % report)
+
+
+@manager.command
+def bench_login(logins=200, threads=8, workers=0, method=None, database_url=None):
+    """Benchmark logins per second for one worker process."""
+    from app.benchmark import make_bench_app, bench_logins
+    with make_bench_app(database_url=database_url) as bench_app:
+        report = bench_logins(bench_app, logins=int(logins), threads=int(threads),
+                              method=method, workers=int(workers))
+    print("[Info]:%(logins)d logins with %(method)s, %(threads)d threads, %(workers)d hash workers "
+          "in %(elapsed).3fs (%(throughput).1f logins/s per worker)" % report)
+    print("[Info]:outcomes %s" % report['outcomes'])
+
+
+@manager.command
+def bench_mail(messages=500, workers=4, batch=50, database_url=None):
+    """Benchmark outbox delivery against a local aiosmtpd server."""
+    from app.benchmark import make_bench_app, bench_mail as run
+    with make_bench_app(database_url=database_url) as bench_app:
+        report = run(bench_app, messages=int(messages), workers=int(workers),
+                     batch_size=int(batch))
+    print("[Info]:%(sent)d/%(messages)d sent (%(received)d received) by %(workers)d workers, "
+          "batches of %(batch_size)d, in %(elapsed).3fs (%(throughput).1f messages/s)" % report)
+
+
+@manager.command
+def bench_render(messages=1000):
+    """Benchmark email template rendering."""
+    from app.benchmark import make_bench_app, bench_email_render
+    with make_bench_app() as bench_app:
+        report = bench_email_render(bench_app, messages=int(messages))
+    print("[Info]:%(messages)d x %(template)s: render_template %(render_template).0f/s, "
+          "render %(render).0f/s, render_many %(render_many).0f/s" % report)
+
+
+@manager.command
+def verify_tokens(purpose='confirm'):
+    """Verify tokens read one per line from stdin, e.g. --purpose reset."""
+    import sys
+    from app.tokens import get_token_service, TokenStatus
+    tokens = [line.strip() for line in sys.stdin if line.strip()]
+    names = dict((v, k.lower()) for k, v in vars(TokenStatus).items() if not k.startswith('_'))
+    for token, result in zip(tokens, get_token_service(app).verify_many(purpose, tokens)):
+        print("[Info]:%s %s %s" % (token[:16], names[result.status], result.data or ''))
+
+
 @manager.command
 def deploy():
     from flask_migrate import upgrade
     from app.models import Role
     upgrade()
     Role.insert_roles()
+    Activity.advance_statuses()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Activity, ActivityQuery, ActivityStatus, Enrollment, EnrollmentResult, \
+    Comment
+
+
+class ActivityModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.publisher = User(email='john@example.com', username='john', password='cat')
+        db.session.add(self.publisher)
+        db.session.commit()
+        self.base = datetime.now() + timedelta(days=1)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_activity(self, location, begin_hours, end_hours, capacity=10):
+        activity = Activity(publisher=self.publisher,
+                            begin_timestamp=self.base + timedelta(hours=begin_hours),
+                            end_timestamp=self.base + timedelta(hours=end_hours),
+                            location=location,
+                            name='seminar',
+                            capacity=capacity)
+        db.session.add(activity)
+        db.session.commit()
+        return activity
+
+    def test_venue_conflict(self):
+        a1 = self.add_activity('hall', 0, 2)
+        a2 = self.add_activity('hall', 4, 6)
+        self.add_activity('library', 0, 6)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', self.base + timedelta(hours=1), self.base + timedelta(hours=5)) == a1)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', self.base + timedelta(hours=5), self.base + timedelta(hours=7)) == a2)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', self.base + timedelta(hours=2, minutes=30),
+            self.base + timedelta(hours=3, minutes=30)) is None)
+        self.assertTrue(Activity.find_venue_conflict(
+            'gym', self.base, self.base + timedelta(hours=6)) is None)
+
+    def test_venue_conflict_touching_boundaries(self):
+        a = self.add_activity('hall', 2, 4)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', self.base, self.base + timedelta(hours=2)) == a)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', self.base + timedelta(hours=4), self.base + timedelta(hours=5)) == a)
+
+    def test_venue_conflict_excludes_self(self):
+        a = self.add_activity('hall', 0, 2)
+        self.assertTrue(Activity.find_venue_conflict(
+            'hall', a.begin_timestamp, a.end_timestamp, exclude_id=a.id) is None)
+
+    def test_enroll(self):
+        a = self.add_activity('hall', 0, 2, capacity=1)
+        u1 = User(email='susan@example.org', username='susan', password='dog')
+        u2 = User(email='david@example.net', username='david', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertTrue(Enrollment.enroll(a, self.publisher) == EnrollmentResult.PUBLISHER)
+        self.assertTrue(Enrollment.enroll(a, u1) == EnrollmentResult.SUCCEED)
+        self.assertTrue(Enrollment.enroll(a, u1) == EnrollmentResult.FULL)
+        self.assertTrue(Enrollment.enroll(a, u2) == EnrollmentResult.FULL)
+        self.assertTrue(a.enrollments.count() == 1)
+
+    def test_enroll_duplicate_and_time_conflict(self):
+        a1 = self.add_activity('hall', 0, 2)
+        a2 = self.add_activity('library', 1, 3)
+        a3 = self.add_activity('gym', 4, 5)
+        u = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(Enrollment.enroll(a1, u) == EnrollmentResult.SUCCEED)
+        self.assertTrue(Enrollment.enroll(a1, u) == EnrollmentResult.DUPLICATE)
+        self.assertTrue(Enrollment.enroll(a2, u) == EnrollmentResult.TIME_CONFLICT)
+        self.assertTrue(Enrollment.enroll(a3, u) == EnrollmentResult.SUCCEED)
+
+    def test_enroll_started_activity(self):
+        a = self.add_activity('hall', -48, -47)
+        u = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(Enrollment.enroll(a, u) == EnrollmentResult.FINISHED)
+
+    def test_concurrent_enroll(self):
+        from app.benchmark import make_bench_app, bench_enroll
+        # sessions are per thread; let the benchmark app open its own
+        db.session.remove()
+        with make_bench_app() as app:
+            report = bench_enroll(app, concurrency=10, capacity=5, activities=2)
+        self.assertFalse(report['oversubscribed'])
+        self.assertTrue(report['double_booked'] == 0)
+        self.assertTrue(report['enrolled'] == report['outcomes']['succeed'])
+
+    def test_counters(self):
+        a = self.add_activity('hall', 0, 2)
+        u = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add(u)
+        db.session.commit()
+        Enrollment.enroll(a, u)
+        db.session.add(Comment(body='great', activity=a, author=u))
+        db.session.commit()
+        self.assertTrue(a.enrolled_count == 1)
+        self.assertTrue(a.comment_count == 1)
+        db.session.delete(a.comments.first())
+        db.session.commit()
+        self.assertTrue(a.comment_count == 0)
+        a.enrolled_count = 5
+        a.comment_count = 5
+        db.session.commit()
+        Activity.recount()
+        self.assertTrue(a.enrolled_count == 1)
+        self.assertTrue(a.comment_count == 0)
+
+    def test_generate_fake_enrollments(self):
+        finished = self.add_activity('hall', -72, -70)
+        reserved = self.add_activity('hall', 0, 2)
+        db.session.add(User(email='susan@example.org', username='susan', password='dog'))
+        db.session.commit()
+        Enrollment.generate_fake(2)
+        self.assertTrue(Enrollment.query.count() == 2)
+        self.assertTrue(finished.enrolled_count == reserved.enrolled_count == 1)
+
+    def test_status_transitions(self):
+        a1 = self.add_activity('hall', 0, 2)
+        a2 = self.add_activity('library', 1, 3)
+        self.assertTrue(a1.status == ActivityStatus.RESERVED)
+        self.assertTrue(Activity.next_status_change() == a1.begin_timestamp)
+        self.assertTrue(Activity.advance_statuses(self.base + timedelta(hours=1)) == 2)
+        self.assertTrue(a1.status == ActivityStatus.ONGOING)
+        self.assertTrue(Activity.next_status_change() == a1.end_timestamp)
+        Activity.advance_statuses(self.base + timedelta(hours=2, minutes=30))
+        self.assertTrue(a1.status == ActivityStatus.FINISHED)
+        self.assertTrue(a2.status == ActivityStatus.ONGOING)
+        self.assertTrue(Activity.advance_statuses(self.base + timedelta(hours=5)) == 1)
+        self.assertTrue(Activity.next_status_change() is None)
+        a1.begin_timestamp = self.base + timedelta(days=1)
+        a1.end_timestamp = self.base + timedelta(days=1, hours=1)
+        db.session.commit()
+        self.assertTrue(a1.status == ActivityStatus.RESERVED)
+
+    def test_delete_many(self):
+        a1 = self.add_activity('hall', 0, 2)
+        a2 = self.add_activity('library', 0, 2)
+        a3 = self.add_activity('garden', 4, 5)
+        u = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add(u)
+        db.session.commit()
+        Enrollment.enroll(a1, u)
+        for a in (a1, a2):
+            db.session.add(Comment(body='great', activity=a, author=u))
+        db.session.commit()
+        self.assertTrue(Activity.delete_many([a2.id], soft=True) == 1)
+        self.assertTrue(a2.disabled and a2.comment_count == 1)
+        self.assertTrue(ActivityQuery().query().count() == 2)
+        self.assertTrue(Activity.find_venue_conflict('library', a2.begin_timestamp,
+                                                     a2.end_timestamp) is None)
+        self.assertTrue(Activity.delete_many([a2.id], soft=True) == 0)
+        ids = [a1.id, a2.id]
+        self.assertTrue(Activity.delete_many(ids) == 2)
+        self.assertTrue(Activity.query.all() == [a3])
+        self.assertTrue(Enrollment.query.count() == 0 and Comment.query.count() == 0)
+
+    def test_joinable(self):
+        a1 = self.add_activity('hall', 0, 2)
+        a2 = self.add_activity('library', 1, 3)
+        a3 = self.add_activity('garden', 4, 5, capacity=1)
+        a4 = self.add_activity('court', 6, 7)
+        u = User(email='susan@example.org', username='susan', password='dog')
+        v = User(email='david@example.net', username='david', password='dog')
+        db.session.add_all([u, v])
+        db.session.commit()
+        self.assertTrue(Enrollment.enroll(a1, u) == EnrollmentResult.SUCCEED)
+        self.assertTrue(Enrollment.enroll(a3, v) == EnrollmentResult.SUCCEED)
+        db.session.commit()
+        self.assertTrue(Enrollment.has_time_conflict(u.id, a2.begin_timestamp, a2.end_timestamp))
+        self.assertFalse(Enrollment.has_time_conflict(u.id, a4.begin_timestamp, a4.end_timestamp))
+        ids = [a.id for a in (a1, a2, a3, a4)]
+        self.assertTrue(Enrollment.time_conflicts(u.id, ids) == set([a1.id, a2.id]))
+        self.assertTrue(Enrollment.time_conflicts(u.id, []) == set())
+        # a1 is joined, a2 overlaps it and a3 is full
+        self.assertTrue(ActivityQuery().joinable_by(u).ordered().all() == [a4])
+        self.assertTrue(ActivityQuery().joinable_by(self.publisher).query().count() == 0)
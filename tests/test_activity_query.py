@@ -0,0 +1,86 @@
+import itertools
+import re
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Follow, Activity, ActivityQuery, ActivityStatus
+
+
+class ActivityQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def explain(self, query):
+        statement = query.limit(6).with_labels().statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        return ' ; '.join(row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN %s' % statement))
+
+    def test_explain_every_combination(self):
+        statuses = [None, ActivityStatus.RESERVED, ActivityStatus.ONGOING, ActivityStatus.FINISHED]
+        orders = [None, ActivityQuery.ASC, ActivityQuery.DESC]
+        for status, begin_order, capacity_order, location, follower_id in itertools.product(
+                statuses, orders, orders, [None, 'hall'], [None, 1]):
+            activity_query = ActivityQuery(status=status, location=location, follower_id=follower_id,
+                                           begin_order=begin_order, capacity_order=capacity_order)
+            plan = self.explain(activity_query.ordered())
+            combination = (status, begin_order, capacity_order, location, follower_id, plan)
+            if location is not None or status is not None:
+                self.assertTrue(re.search(r'SEARCH (TABLE )?activities USING INDEX '
+                                          r'ix_activities_(location|status)', plan), combination)
+            elif capacity_order is None or begin_order is not None:
+                self.assertTrue(re.search(r'activities USING INDEX', plan), combination)
+            elif follower_id is not None:
+                # ordered by capacity alone: the followed publishers' rows are
+                # found through the publisher index, then sorted
+                self.assertTrue(re.search(r'SEARCH (TABLE )?activities USING INDEX '
+                                          r'ix_activities_publisher_publish', plan), combination)
+            else:
+                # ordered by capacity alone over every activity: there is
+                # deliberately no capacity index, so this sorts a full scan
+                self.assertTrue(re.search(r'SCAN (TABLE )?activities\b', plan) and
+                                'TEMP B-TREE FOR ORDER BY' in plan, combination)
+
+    def test_filters(self):
+        now = datetime.now()
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add_all([u1, u2, Follow(follower=u2, followed=u1)])
+        past = Activity(publisher=u1, location='hall', capacity=20, name='past',
+                        begin_timestamp=now - timedelta(days=2),
+                        end_timestamp=now - timedelta(days=2) + timedelta(hours=1))
+        ongoing = Activity(publisher=u2, location='hall', capacity=30, name='ongoing',
+                           begin_timestamp=now - timedelta(hours=1),
+                           end_timestamp=now + timedelta(hours=1))
+        future = Activity(publisher=u1, location='library', capacity=10, name='future',
+                          begin_timestamp=now + timedelta(days=2),
+                          end_timestamp=now + timedelta(days=2, hours=1))
+        db.session.add_all([past, ongoing, future])
+        db.session.commit()
+
+        base = ActivityQuery()
+        self.assertTrue(base.with_status(ActivityStatus.RESERVED).ordered().all() == [future])
+        self.assertTrue(base.with_status(ActivityStatus.ONGOING).ordered().all() == [ongoing])
+        self.assertTrue(base.with_status(ActivityStatus.FINISHED).ordered().all() == [past])
+        self.assertTrue(base.at('hall').order_by_begin(ActivityQuery.DESC).ordered().all() ==
+                        [ongoing, past])
+        self.assertTrue(base.order_by_capacity(ActivityQuery.ASC).ordered().all() ==
+                        [future, past, ongoing])
+        self.assertTrue(base.between(now - timedelta(days=1), now + timedelta(days=1)).ordered().all() ==
+                        [ongoing])
+        self.assertTrue(base.followed_by(u2).order_by_begin(ActivityQuery.ASC).ordered().all() ==
+                        [past, future])
+        self.assertTrue(base.at('hall').with_status(None).ordered().count() == 2)
+
+    def test_main_queries_use_indexes(self):
+        from app.plans import check_plans
+        for name, plan, scans in check_plans():
+            self.assertTrue(scans == [], (name, plan))
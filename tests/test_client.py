@@ -0,0 +1,156 @@
+import json
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db
+from app.models import User, Role, Activity, Comment, Enrollment
+
+
+class FlaskClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_activities(self, count):
+        base = datetime.now() + timedelta(days=1)
+        for i in range(count):
+            u = User(email='user%d@example.com' % i, username='user%d' % i, password='cat')
+            a = Activity(publisher=u,
+                         begin_timestamp=base + timedelta(hours=2 * i),
+                         end_timestamp=base + timedelta(hours=2 * i + 1),
+                         location='hall',
+                         name='seminar %d' % i,
+                         capacity=10)
+            db.session.add_all([u, a, Comment(body='hi', activity=a, author=u)])
+        db.session.commit()
+        db.session.expunge_all()
+
+    def count_queries(self, url):
+        before = len(get_debug_queries())
+        response = self.client.get(url)
+        self.assertTrue(response.status_code == 200)
+        return len(get_debug_queries()) - before
+
+    def test_index_query_count(self):
+        self.add_activities(self.app.config['FLASKY_ACTIVITIES_PER_PAGE'])
+        self.assertTrue(self.count_queries('/') <= 3)
+
+    def test_user_page_query_count(self):
+        self.add_activities(self.app.config['FLASKY_ACTIVITIES_PER_PAGE'])
+        self.assertTrue(self.count_queries('/user/user0') <= 4)
+
+    def test_activity_page_query_count(self):
+        self.add_activities(10)
+        activity = Activity.query.first()
+        for u in User.query.filter(User.id != activity.publisher_id):
+            db.session.add(Enrollment(activity_id=activity.id, participant_id=u.id))
+            db.session.add(Comment(body='hi', activity_id=activity.id, author_id=u.id))
+        db.session.commit()
+        url = '/activity/%d' % activity.id
+        db.session.expunge_all()
+        self.assertTrue(self.count_queries(url) <= 6)
+        response = self.client.get(url + '?comment_page=-1')
+        self.assertTrue(b'user9' in response.data)
+
+    def test_index_keyset_pagination(self):
+        self.add_activities(12)
+        url, seen, pages = '/', [], []
+        while url:
+            data = self.client.get(url).get_data(as_text=True)
+            names = re.findall(r'seminar \d+', data)
+            seen.extend(names)
+            pages.append(url)
+            match = re.search(r'href="(/\?after=[^"]+)"', data)
+            url = match.group(1).replace('&amp;', '&') if match else None
+        self.assertTrue(len(pages) == 3)
+        self.assertTrue(sorted(seen) == sorted('seminar %d' % i for i in range(12)))
+        data = self.client.get(pages[-1]).get_data(as_text=True)
+        prev_url = re.search(r'href="(/\?before=[^"]+)"', data).group(1)
+        data = self.client.get(prev_url.replace('&amp;', '&')).get_data(as_text=True)
+        self.assertTrue(re.findall(r'seminar \d+', data) == seen[5:10])
+        self.assertTrue(self.client.get('/?after=garbage').status_code == 400)
+        self.assertTrue(self.client.get('/?after=W1tdLDFd').status_code == 400)
+
+    def test_index_filter_in_query_string(self):
+        self.add_activities(12)
+        data = self.client.get('/?capacity_order=2&location=hall').get_data(as_text=True)
+        self.assertTrue('location: hall' in data)
+        self.assertTrue(re.search(r'href="/\?[^"]*location=hall', data))
+        data = self.client.get('/?location=elsewhere').get_data(as_text=True)
+        self.assertFalse(re.search(r'seminar \d+', data))
+        # the filter is per request, not remembered between requests
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertTrue('location: all' in data)
+
+    def test_avatar_proxy(self):
+        self.app.config['FLASKY_AVATAR_CACHE_DIR'] = cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.add_activities(1)
+        data = self.client.get('/').get_data(as_text=True)
+        url = re.search(r'src="(/avatar/[0-9a-f]{32}/140)"', data).group(1)
+        response = self.client.get(url)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == 'image/png')
+        self.assertTrue(response.get_data().startswith(b'\x89PNG'))
+        self.assertTrue('max-age' in response.headers['Cache-Control'])
+        response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(self.client.get('/avatar/nothex/140').status_code == 404)
+        for hash in ('0x' + '0' * 30, '+' + '0' * 31, ' ' + '0' * 31, '0' * 31 + '%20'):
+            self.assertTrue(self.client.get('/avatar/%s/40' % hash).status_code == 404, hash)
+        self.assertTrue(self.client.get(url.replace('/140', '/4096')).status_code == 404)
+
+    def test_conditional_get(self):
+        self.add_activities(2)
+        response = self.client.get('/')
+        etag = response.headers['ETag']
+        self.assertTrue('no-cache' in response.headers['Cache-Control'])
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 304)
+        self.assertTrue(len(self.app.extensions['page_cache']._pages) == 1)
+        activity = Activity.query.first()
+        activity.capacity = 20
+        url = '/activity/%d' % activity.id
+        db.session.commit()
+        db.session.expunge_all()
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers['ETag'] != etag)
+        response = self.client.get(url)
+        self.assertTrue(self.client.get(url, headers={
+            'If-None-Match': response.headers['ETag']}).status_code == 304)
+
+    def test_request_profiler(self):
+        self.add_activities(3)
+        response = self.client.get('/')
+        self.assertTrue('db;dur=' in response.headers['Server-Timing'])
+        self.client.get('/user/user0')
+        summary = self.app.extensions['perf'].summary()
+        self.assertTrue(summary['buffered'] == 2)
+        index = [item for item in summary['endpoints'] if item['endpoint'] == 'main.index'][0]
+        self.assertTrue(index['queries'] >= 1 and index['render_ms'] > 0)
+        self.assertTrue(self.client.get('/_perf').status_code == 302)
+        admin = User(email=self.app.config['FLASKY_ADMIN'], username='admin', password='cat',
+                     confirmed=True)
+        db.session.add(admin)
+        db.session.commit()
+        self.client.post('/auth/login', data={'email': admin.email, 'password': 'cat'})
+        data = json.loads(self.client.get('/_perf').get_data(as_text=True))
+        self.assertTrue('main.user' in [item['endpoint'] for item in data['endpoints']])
+        profiler = self.app.extensions['perf']
+        profiler.sample_rate = 0
+        buffered = len(profiler.records)
+        self.assertTrue('Server-Timing' not in self.client.get('/').headers)
+        self.assertTrue(len(profiler.records) == buffered)
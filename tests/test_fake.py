@@ -0,0 +1,100 @@
+import os
+import time
+import unittest
+from datetime import datetime
+from sqlalchemy.orm import aliased
+from app import create_app, db
+from app.models import User, Role, Activity, Enrollment, Comment
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class BulkFakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generate_bulk(self):
+        from app.fake import generate_bulk
+        now = datetime(2017, 6, 1, 12)
+        counts = generate_bulk(scale=0.004, seed=1, now=now)
+        self.assertTrue(counts['users'] == User.query.count() == 200)
+        self.assertTrue(counts['activities'] == Activity.query.count() == 200)
+        self.assertTrue(counts['enrollments'] == Enrollment.query.count() > 1000)
+        self.assertTrue(counts['comments'] == Comment.query.count() > 0)
+
+        other = aliased(Activity)
+        self.assertTrue(db.session.query(Activity).join(
+            other, db.and_(other.location == Activity.location, other.id != Activity.id,
+                           other.begin_timestamp <= Activity.end_timestamp,
+                           other.end_timestamp >= Activity.begin_timestamp)).count() == 0)
+        e1, e2, a1, a2 = aliased(Enrollment), aliased(Enrollment), aliased(Activity), aliased(Activity)
+        self.assertTrue(db.session.query(e1).join(
+            e2, db.and_(e2.participant_id == e1.participant_id, e2.id != e1.id)).
+            join(a1, a1.id == e1.activity_id).join(a2, a2.id == e2.activity_id).
+            filter(a2.begin_timestamp <= a1.end_timestamp,
+                   a2.end_timestamp >= a1.begin_timestamp).count() == 0)
+        self.assertTrue(Enrollment.query.join(Activity).filter(
+            Activity.publisher_id == Enrollment.participant_id).count() == 0)
+        for activity in Activity.query:
+            self.assertTrue(activity.enrolled_count == activity.enrollments.count() <= activity.capacity)
+            self.assertTrue(activity.comment_count == activity.comments.count())
+            self.assertTrue(activity.status == activity._get_status(now))
+
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        self.assertTrue(generate_bulk(scale=0.004, seed=1, now=now) == counts)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_generate_bulk_default_now(self):
+        from app.fake import generate_bulk
+        # far west of UTC, where scheduling on the UTC clock stores activities
+        # of the next 12 hours as ongoing or finished; ten venues make sure
+        # some activity starts or ends in that window
+        tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'XXX12'
+        time.tzset()
+        try:
+            generate_bulk(scale=0.02, seed=1)
+            for activity in Activity.query:
+                self.assertTrue(activity.status == activity._get_status())
+                self.assertTrue(activity.publish_timestamp <= datetime.utcnow())
+            for user in User.query:
+                self.assertTrue(user.member_since <= datetime.utcnow())
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+
+    def test_bench_routes(self):
+        from app.benchmark import make_bench_app, bench_routes, compare_reports
+        # sessions are per thread; let the benchmark app open its own
+        db.session.remove()
+        with make_bench_app() as app:
+            report = bench_routes(app, scale=0.002, requests=4)
+        # the scratch database goes away with the context
+        self.assertFalse(os.path.exists(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]))
+        self.assertTrue(len(report['routes']) == 9)
+        for name, route in report['routes'].items():
+            self.assertTrue(sum(route['statuses'].values()) == 4, name)
+            self.assertTrue(set(route['statuses']) <= set(['200', '302']), (name, route))
+            self.assertTrue(route['queries'] >= 1, name)
+        self.assertTrue(compare_reports(report, report) == [])
+        slower = {'routes': dict((name, dict(route, p95_ms=route['p95_ms'] * 2 + 10))
+                                 for name, route in report['routes'].items())}
+        self.assertTrue(len(compare_reports(slower, report)) == 9)
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from flask_migrate import Migrate, upgrade, downgrade
+from app import create_app, db
+from app.models import ActivityStatus
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        # alembic opens its own connections, so an in-memory database would
+        # vanish between them
+        self.tmp = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.tmp, 'data.sqlite')
+        Migrate(self.app, db)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmp)
+
+    def test_upgrade_baseline_data(self):
+        # a database as the baseline models built it, with some data
+        upgrade(directory=MIGRATIONS, revision='0001')
+        now = datetime.now()
+        db.session.execute("INSERT INTO users (id, email, username) "
+                           "VALUES (1, 'john@example.com', 'john'), (2, 'susan@example.org', 'susan')")
+        for id, begin in ((1, now - timedelta(days=1)), (2, now - timedelta(hours=1)),
+                          (3, now + timedelta(days=1))):
+            db.session.execute("INSERT INTO activities (id, publisher_id, begin_timestamp, end_timestamp, "
+                               "location, name, capacity) VALUES (:id, 1, :begin, :end, 'hall', 'x', 10)",
+                               {'id': id, 'begin': begin, 'end': begin + timedelta(hours=2)})
+        db.session.execute("INSERT INTO enrollment (activity_id, participant_id) "
+                           "VALUES (1, 2), (1, 2), (3, 2)")
+        db.session.execute("INSERT INTO comments (activity_id, author_id, body) VALUES (1, 2, 'great')")
+        db.session.commit()
+
+        upgrade(directory=MIGRATIONS)
+        rows = db.session.execute('SELECT id, enrolled_count, comment_count, status '
+                                  'FROM activities ORDER BY id').fetchall()
+        self.assertTrue([tuple(row) for row in rows] == [
+            (1, 1, 1, ActivityStatus.FINISHED),
+            (2, 0, 0, ActivityStatus.ONGOING),
+            (3, 1, 0, ActivityStatus.RESERVED)])
+        self.assertTrue(db.session.execute('SELECT count(*) FROM outbox').scalar() == 0)
+        db.session.remove()
+
+        downgrade(directory=MIGRATIONS, revision='base')
+        self.assertTrue(db.engine.table_names() == ['alembic_version'])
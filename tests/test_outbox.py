@@ -0,0 +1,88 @@
+import unittest
+from datetime import datetime
+from app import create_app, db, mail
+from flask import render_template
+from app.email import MailOutbox, send_email, send_bulk_email
+from app.models import User, Role, OutboxMessage
+
+try:
+    import aiosmtpd
+except ImportError:
+    aiosmtpd = None
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def queue(self, count):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        with self.app.test_request_context('/'):
+            for i in range(count):
+                send_email(u.email, 'Confirm Your Account', 'auth/email/confirm', user=u, token='t')
+
+    def test_send_email_is_queued_and_delivered(self):
+        self.queue(3)
+        self.assertTrue(OutboxMessage.query.count() == 3)
+        self.app.config['FLASKY_MAIL_BATCH_SIZE'] = 2
+        outbox = MailOutbox(self.app)
+        with mail.record_messages() as messages:
+            self.assertTrue(outbox.drain() == 3)
+        self.assertTrue(len(messages) == 3)
+        self.assertTrue(messages[0].recipients == ['john@example.com'])
+        self.assertTrue(OutboxMessage.query.count() == 0)
+
+    def test_renderer_matches_render_template(self):
+        renderer = self.app.extensions['email_renderer']
+        with self.app.test_request_context('/'):
+            context = {'user': {'username': 'john'}, 'token': 'abc'}
+            expected = (render_template('auth/email/confirm.txt', **context),
+                        render_template('auth/email/confirm.html', **context))
+            self.assertTrue(renderer.render('auth/email/confirm', **context) == expected)
+            messages = send_bulk_email(['a@example.com', 'b@example.com'], 'Confirm Your Account',
+                                       'auth/email/confirm',
+                                       [{'user': {'username': 'a'}}, {'user': {'username': 'b'}}],
+                                       token='abc')
+        self.assertTrue(OutboxMessage.query.count() == 2)
+        self.assertTrue('Dear b,' in messages[1].body)
+        self.assertTrue('/auth/confirm/abc' in messages[1].html)
+
+    def test_failed_delivery_backs_off(self):
+        self.queue(2)
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=1, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app)
+        outbox = MailOutbox(self.app)
+        self.assertTrue(outbox.deliver() == (0, 2))
+        self.assertTrue(outbox.deliver() == (0, 0))
+        for message in OutboxMessage.query:
+            self.assertTrue(message.attempts == 1 and message.lease is None)
+            self.assertTrue(message.next_attempt > datetime.utcnow())
+            self.assertTrue('Error' in message.last_error)
+        self.app.config['FLASKY_MAIL_MAX_ATTEMPTS'] = 2
+        OutboxMessage.query.update({'next_attempt': datetime.utcnow()})
+        db.session.commit()
+        outbox = MailOutbox(self.app)
+        self.assertTrue(outbox.deliver() == (0, 2))
+        for message in OutboxMessage.query:
+            self.assertTrue(message.attempts == 2 and message.next_attempt is None)
+        self.assertTrue(outbox.deliver() == (0, 0))
+
+    @unittest.skipIf(aiosmtpd is None, 'aiosmtpd is not installed')
+    def test_bench_mail(self):
+        from app.benchmark import make_bench_app, bench_mail
+        # sessions are per thread; let the benchmark app open its own
+        db.session.remove()
+        with make_bench_app() as app:
+            report = bench_mail(app, messages=30, workers=2, batch_size=5)
+        self.assertTrue(report['sent'] == report['received'] == 30)
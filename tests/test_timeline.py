@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Follow, Activity, ActivityQuery
+from werkzeug.exceptions import BadRequest
+from app.pagination import paginate_keyset, encode_cursor
+from app.timeline import Timeline, LocalTimelineStore
+
+
+class TimelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_activities(self, publisher, count, start):
+        base = datetime.now() + timedelta(days=1)
+        activities = []
+        for i in range(start, start + count):
+            activities.append(Activity(publisher=publisher, location='room %d' % i, capacity=10,
+                                       name='seminar %d' % i,
+                                       publish_timestamp=datetime(2017, 1, 1) + timedelta(minutes=i),
+                                       begin_timestamp=base, end_timestamp=base + timedelta(hours=1)))
+        db.session.add_all(activities)
+        db.session.commit()
+        return activities
+
+    def walk(self, page):
+        pages, url = [], '/'
+        while url:
+            with self.app.test_request_context(url):
+                pagination = page()
+            pages.append([activity.name for activity in pagination.items])
+            url = '/?after=%s' % pagination.next_cursor if pagination.has_next else None
+        return pages
+
+    def test_store_is_bounded(self):
+        store = LocalTimelineStore(max_users=2, length=3)
+        store.set(1, [(3, 3), (2, 2), (1, 1)])
+        store.push([1, 2], (4, 4))
+        self.assertTrue(store.get(1) == [(4, 4), (3, 3), (2, 2)])
+        self.assertTrue(store.get(2) is None)
+        store.set(2, [])
+        store.set(3, [])
+        self.assertTrue(store.get(1) is None)
+
+    def test_pages_match_join(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        u3 = User(email='david@example.net', username='david', password='dog')
+        db.session.add_all([u1, u2, u3, Follow(follower=u3, followed=u1), Follow(follower=u3, followed=u2)])
+        self.add_activities(u1, 6, 0)
+        self.add_activities(u2, 6, 6)
+        timeline = Timeline(LocalTimelineStore(length=8))
+        query = ActivityQuery().followed_by(u3)
+        expected = self.walk(lambda: paginate_keyset(query.query(), query.order_by(), per_page=5))
+
+        self.assertTrue(self.walk(lambda: timeline.paginate(u3, 5) or
+                                  paginate_keyset(query.query(), query.order_by(), per_page=5)) ==
+                        expected)
+        with self.app.test_request_context('/'):
+            self.assertTrue(timeline.paginate(u3, 5) is not None)
+
+        activity, = self.add_activities(u2, 1, 12)
+        timeline.on_publish(activity)
+        self.assertTrue(timeline.store.get(u3.id)[0] == (activity.publish_timestamp, activity.id))
+        with self.app.test_request_context('/'):
+            self.assertTrue(timeline.paginate(u3, 5).items[0] == activity)
+
+    def test_pages_back_past_list(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        db.session.add_all([u1, u2, Follow(follower=u2, followed=u1)])
+        self.add_activities(u1, 12, 0)
+        timeline = Timeline(LocalTimelineStore(length=8))
+        query = ActivityQuery().followed_by(u2)
+
+        paginations = []
+
+        def page():
+            paginations.append(timeline.paginate(u2, 5) or
+                               paginate_keyset(query.query(), query.order_by(), per_page=5))
+            return paginations[-1]
+
+        forward = self.walk(page)
+        # back from the last page, which came from the database
+        pagination = paginations[-1]
+        backward = []
+        while pagination.has_prev:
+            with self.app.test_request_context('/?before=%s' % pagination.prev_cursor):
+                pagination = page()
+            backward.append([activity.name for activity in pagination.items])
+        self.assertTrue(backward == forward[-2::-1])
+
+    def test_malformed_cursor(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        timeline = Timeline(LocalTimelineStore())
+        query = ActivityQuery()
+        # both decode, to [[], 1] and ["x", "y"], but do not fit the sort columns
+        for cursor in ('W1tdLDFd', encode_cursor(['x', 'y']), encode_cursor([1])):
+            for page in (lambda: timeline.paginate(u, 5),
+                         lambda: paginate_keyset(query.query(), query.order_by(), per_page=5)):
+                with self.app.test_request_context('/?after=' + cursor):
+                    with self.assertRaises(BadRequest):
+                        page()
@@ -1,7 +1,9 @@
 import unittest
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from app import create_app, db
+from flask_sqlalchemy import get_debug_queries
+from app.last_seen import LastSeenBuffer
 from app.models import User, AnonymousUser, Role, Permission
 
 
@@ -125,6 +127,89 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(
             (datetime.utcnow() - u.last_seen).total_seconds() < 3)
 
+    def test_permission_checks_do_not_query(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        u = User.query.get(u.id)
+        before = len(get_debug_queries())
+        self.assertTrue(u.can(Permission.COMMENT))
+        self.assertFalse(u.is_administrator())
+        self.assertTrue(u.can(Permission.FOLLOW))
+        self.assertTrue(len(get_debug_queries()) - before <= 1)
+        before = len(get_debug_queries())
+        self.assertTrue(u.can(Permission.PUBLISH_ACTIVITY))
+        self.assertTrue(len(get_debug_queries()) == before)
+        moderator = Role.query.filter_by(name='Moderator').first()
+        u.role = moderator
+        db.session.commit()
+        self.assertTrue(u.can(Permission.MODERATE_COMMENTS))
+        moderator.permissions = Permission.FOLLOW
+        db.session.commit()
+        self.assertFalse(u.can(Permission.MODERATE_COMMENTS))
+
+    def test_roles_seeded_without_request(self):
+        Role.query.delete()
+        db.session.commit()
+        Role.invalidate_permission_map()
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.role_id is not None and u.role.default)
+        self.assertTrue(Role.query.count() == 3)
+        Role.query.delete()
+        db.session.commit()
+        Role.invalidate_permission_map()
+        User.create_many([{'email': 'susan@example.org', 'username': 'susan', 'password_hash': 'x'}])
+        self.assertTrue(User.query.filter_by(username='susan').first().role_id is not None)
+
+    def test_create_many(self):
+        before = len(get_debug_queries())
+        count = User.create_many([{'email': 'user%d@example.com' % i, 'username': 'user%d' % i,
+                                   'password_hash': 'x'} for i in range(100)] +
+                                 [{'email': self.app.config['FLASKY_ADMIN'], 'password': 'cat'}])
+        self.assertTrue(count == 101)
+        self.assertTrue(len(get_debug_queries()) - before <= 3)
+        self.assertTrue(User.query.count() == 101)
+        u = User.query.filter_by(username='user42').first()
+        self.assertTrue(u.role.default and not u.confirmed and u.member_since is not None)
+        admin = User.query.filter_by(email=self.app.config['FLASKY_ADMIN']).first()
+        self.assertTrue(admin.is_administrator() and admin.verify_password('cat'))
+        before = len(get_debug_queries())
+        User(email='john@example.com', password='cat')
+        self.assertTrue(len(get_debug_queries()) == before)
+
+    def test_rehash_on_login(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        passwords = self.app.extensions['passwords']
+        self.assertFalse(passwords.needs_rehash(u.password_hash))
+        old_hash = u.password_hash
+        passwords.method = 'pbkdf2:sha256:2000'
+        self.assertFalse(u.verify_password('dog'))
+        self.assertTrue(u.password_hash == old_hash)
+        self.assertTrue(u.verify_password('cat'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(u.verify_password('cat'))
+
+    def test_token_purposes_and_batch_verify(self):
+        from app.tokens import TokenStatus
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        tokens = self.app.extensions['tokens']
+        reset_token = u.generate_reset_token()
+        self.assertFalse(u.confirm(reset_token))
+        self.assertTrue(tokens.verify('reset', reset_token).data == {'reset': u.id})
+        expired = u.generate_confirmation_token(1)
+        time.sleep(2)
+        results = tokens.verify_many('confirm', [u.generate_confirmation_token(), expired,
+                                                 reset_token, 'garbage'])
+        self.assertTrue([result.status for result in results] ==
+                        [TokenStatus.VALID, TokenStatus.EXPIRED, TokenStatus.INVALID,
+                         TokenStatus.INVALID])
+
     def test_ping(self):
         u = User(password='cat')
         db.session.add(u)
@@ -134,6 +219,21 @@ class UserModelTestCase(unittest.TestCase):
         u.ping()
         self.assertTrue(u.last_seen > last_seen_before)
 
+    def test_ping_is_buffered(self):
+        u = User(password='cat', last_seen=datetime.utcnow() - timedelta(hours=1))
+        db.session.add(u)
+        db.session.commit()
+        buffer = self.app.extensions['last_seen_buffer'] = LastSeenBuffer(self.app)
+        user_id = u.id
+        u.ping()
+        pinged = u.last_seen
+        self.assertFalse(db.session.dirty)
+        u.ping()
+        self.assertFalse(db.session.dirty)
+        self.assertTrue(buffer.flush() == 1)
+        self.assertTrue(User.query.get(user_id).last_seen == pinged)
+        self.assertTrue(buffer.flush() == 0)
+
     def test_gravatar(self):
         u = User(email='john@example.com', password='cat')
         with self.app.test_request_context('/'):